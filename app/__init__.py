@@ -7,10 +7,6 @@ from flask import Flask, url_for
 from flask_sqlalchemy import SQLAlchemy
 from importlib import import_module
 from logging import basicConfig, DEBUG, getLogger, StreamHandler
-import os
-import json
-import yaml
-from dateutil import parser
 
 
 db = SQLAlchemy()
@@ -18,139 +14,64 @@ db = SQLAlchemy()
 # Must be aster db is created.
 from app.db_commands import (
     PUBLISH_MAP,
+    create_indexes,
     publish,
+    publish_attrs,
     publish_tags,
 )
-
-
-CURRENT_LEGISLATORS_PATH = os.path.join(
-    os.path.dirname(os.path.abspath(__name__)),
-    "app",
-    "data",
-    "legislators-current.yaml"
-)
-
-EXECUTIVE_PATH = os.path.join(
-    os.path.dirname(os.path.abspath(__name__)),
-    "app",
-    "data",
-    "executive.yaml"
+from app.cache import query_cache
+from app.fts import drop_fts_table, sync_fts
+from app.reference import (
+    check_reference_data,
+    current_reference,
+    load_reference_data,
 )
+from app.search import MAX_PAGE_SIZE
+from app.suggest import load_vocabulary
 
-govtrack_ids = {}
-lis_ids = {}
-bioguide_ids = {}
-fec_ids = {}
-committee_ids = {}
-schedule_b_codes = {}
-
-id_maps = {
-    "govtrack": govtrack_ids,
-    "lis": lis_ids,
-    "bioguide": bioguide_ids,
-    "fec": fec_ids,
-    "committee": committee_ids,
-    "schedule_b_codes": schedule_b_codes,
-}
-
-
-def load_memory_data():
-    # TODO: Get rid of the globals
-    global govtrack_ids
-    global lis_ids
-    global bioguide_ids
-    global fec_ids
-    global committee_ids
-    global schedule_b_codes
 
+def load_memory_data(rebuild=False):
+    """Load the reference data, rebuilding its snapshot if it is stale."""
     print("Initializing memory data ...")
-    # For now, assuming legislators and executive are mutually exclusive
-    with open(CURRENT_LEGISLATORS_PATH, "r") as f1:
-        with open(EXECUTIVE_PATH, "r") as f2:
-            info = yaml.safe_load(f1) + yaml.safe_load(f2)
-            for c in info:
-                details = {key: c[key] for key in c}
-                if "govtrack" in c["id"]:
-                    govtrack_ids[c["id"]["govtrack"]] = details
-
-                if "bioguide" in c["id"]:
-                    bioguide_ids[c["id"]["bioguide"]] = details
-
-                if "lis" in c["id"]:
-                    lis_ids[c["id"]["lis"]] = details
-
-            for profile in govtrack_ids.values():
-                if "official_full" not in profile["name"]:
-                    name = []
-                    for key in ["first", "middle", "last"]:
-                        name.append(profile["name"].get(key, ""))
-                    profile["name"]["official_full"] = " ".join(tok for tok in name if tok)
-
-            # Map FEC ID to profile
-            for gid in govtrack_ids:
-                for fec_id in govtrack_ids[gid]["id"].get("fec", []):
-                    fec_ids[fec_id] = govtrack_ids[gid]
-
-
-    # Parse FEC info
-    # For now just 2020
-    # TODO: parse all years
-    with open("app/data/weball20.txt") as f:
-        for line in f:
-            data = line.split("|")
-            fec_id = data[0]
-            name = data[1]
-            try:
-                last, first = name.split(",", 1)
-            except:
-                try:
-                    last, first = name.split(" ", 1)
-                except:
-                    full_name = name
-                    last = name
-                    first = name
-            last = last.strip().capitalize()
-            first = first.strip().capitalize()
-            full_name = f"{first} {last}"
-
-            if fec_id not in fec_ids:
-                info = {
-                    "id": {"fec":[fec_id]},
-                    "name": {
-                        "first":first,
-                        "last":last,
-                        "official_full": full_name
-                    }
-                }
-                fec_ids[fec_id] = info
-
-
-    # Parse FEC info
-    # For now just 2020
-    # TODO: parse all years
-    with open("app/data/cm20.txt") as f:
-        for line in f:
-            data = line.split("|")
-            fec_id = data[0]
-            name = data[1]
-            committee_ids[fec_id] = name
-
-
-    with open("app/data/schedule_b_codes.txt") as f:
-        for line in f:
-            data = line.split(" ", 1)
-            schedule_b_codes[data[0].strip()] = data[1].strip()
+    load_reference_data(rebuild=rebuild)
+
+def preload_memory_data(app):
+    """
+    Load everything the workers share before gunicorn forks them.
+
+    Run in the master with preload_app, the maps are then shared
+    copy-on-write by every worker (see gunicorn-cfg.py, which also freezes
+    them out of the garbage collector). Connections opened here are
+    disposed of so that no worker inherits a database socket.
+    """
+    with app.app_context():
+        db.create_all()
+        create_indexes(db)
+        load_memory_data()
+        load_vocabulary()
+        db.session.remove()
+        db.engine.dispose()
 
 def memory_initialization(app):
+    @app.before_request
+    def check_reload():
+        check_reference_data()
+
+    if app.config.get("PRELOAD_REFERENCE_DATA"):
+        preload_memory_data(app)
+        return
+
     @app.before_first_request
     def load():
         load_memory_data()
+        load_vocabulary()
 
 def register_extensions(app):
     db.init_app(app)
+    query_cache.init_app(app)
 
 def register_blueprints(app):
-    for module_name in ('base', 'home'):
+    for module_name in ('base', 'home', 'api'):
         module = import_module('app.{}.routes'.format(module_name))
         app.register_blueprint(module.blueprint)
 
@@ -159,6 +80,7 @@ def configure_database(app):
     @app.before_first_request
     def initialize_database():
         db.create_all()
+        create_indexes(db)
 
     @app.teardown_request
     def shutdown_session(exception=None):
@@ -176,18 +98,40 @@ def register_commands(app):
             return
         else:
             load_memory_data()
-            f(db, source_dir, id_maps)
+            f(db, source_dir, current_reference())
 
     @app.cli.command("publish")
     @click.argument('filename')
-    def publish_all(filename):
+    @click.option('--concurrency', type=int, default=None,
+                  help="Manifest entries published at once (0: all, default PUBLISH_CONCURRENCY).")
+    def publish_all(filename, concurrency):
         """Publish data to the database."""
         load_memory_data()
-        publish(db, filename, id_maps)
+        publish(db, filename, current_reference(), concurrency)
+
+    @app.cli.command("build-snapshot")
+    def build_snapshot():
+        """Rebuild the reference data snapshot; running workers reload it."""
+        load_memory_data(rebuild=True)
 
     @app.cli.command("tag-db")
-    def tag_db():
-        publish_tags(db)
+    @click.option('--rebuild', is_flag=True, help="Drop and rebuild the tag index.")
+    def tag_db(rebuild):
+        """Add results published since the last run to the tag index."""
+        publish_tags(db, rebuild=rebuild)
+
+    @app.cli.command("index-attrs")
+    def index_attrs():
+        """Backfill the details attribute index for older results."""
+        publish_attrs(db)
+
+    @app.cli.command("fts-sync")
+    @click.option('--rebuild', is_flag=True, help="Drop and rebuild the index.")
+    def fts_sync(rebuild):
+        """Bring the full-text search table up to date."""
+        if rebuild:
+            drop_fts_table(db)
+        sync_fts(db)
 
     @app.cli.command("cust")
     def cust():
@@ -196,7 +140,10 @@ def register_commands(app):
 
     app.cli.add_command(publish_data)
     app.cli.add_command(publish_all)
+    app.cli.add_command(build_snapshot)
     app.cli.add_command(tag_db)
+    app.cli.add_command(index_attrs)
+    app.cli.add_command(fts_sync)
     app.cli.add_command(cust)
 
 def register_filters(app):
@@ -206,26 +153,24 @@ def register_filters(app):
 
     @app.template_filter('smart_find')
     def smart_find(id):
-        for collection in [bioguide_ids, lis_ids, fec_ids, govtrack_ids]:
-            if id in collection:
-                return collection[id]["name"]["official_full"]
-        return id
+        entry = current_reference().names.get(id)
+        return entry.name if entry else id
 
     @app.template_filter('bioguide_to_name')
     def bioguide_to_name(id):
-        return bioguide_ids[id]["name"]["official_full"]
+        return smart_find(id)
 
     @app.template_filter('fec_to_name')
     def fec_to_name(id):
-        return fec_ids[id]["name"]["official_full"]
+        return smart_find(id)
 
     @app.template_filter('committee_id_to_name')
     def committee_id_to_name(id):
-        return committee_ids[id]
+        return smart_find(id)
 
     @app.template_filter('schdb_code')
     def schdb_code(code):
-        return schedule_b_codes.get(code)
+        return current_reference()["schedule_b_codes"].get(code)
 
     @app.template_filter('qurl')
     def query_url(query):
@@ -245,45 +190,37 @@ def register_filters(app):
 
     @app.template_filter('govtrack_cand_url')
     def govtrack_cand_url(id):
-        if id in bioguide_ids:
-            id = bioguide_ids[id]["id"]["govtrack"]
-        elif id in lis_ids:
-            id = lis_ids[id]["id"]["govtrack"]
-        else:
-            return f"index/q={id}"
-        return f"https://www.govtrack.us/congress/members/{id}"
+        entry = current_reference().names.get(id)
+        if entry and entry.govtrack_url:
+            return entry.govtrack_url
+        return f"index/q={id}"
 
     @app.template_filter('next_page')
-    def next_page(params, n):
+    def next_page(params, cursor):
         new_params = params.copy()
-        start = int(params["start"]) if "start" in params else 0
-        n_per_page = int(params["npp"]) if "npp" in params else 100
-        new_params["start"] = start + n_per_page
+        new_params["cursor"] = cursor
         return new_params
 
     @app.template_filter('prev_page')
-    def prev_page(params, n):
+    def prev_page(params, cursor):
         new_params = params.copy()
-        start = int(params["start"]) if "start" in params else 0
-        n_per_page = int(params["npp"]) if "npp" in params else 100
-        new_params["start"] = max(0, start - n_per_page)
+        new_params["cursor"] = cursor
         return new_params
 
     @app.template_filter('show_all')
     def show_all(params, n):
         new_params = params.copy()
-        start = int(params["start"]) if "start" in params else 0
-        n_per_page = int(params["npp"]) if "npp" in params else 100
-        new_params["start"] = 0
-        new_params["npp"] = n
+        if "cursor" in params:
+            del new_params["cursor"]
+        new_params["npp"] = min(n, MAX_PAGE_SIZE)
         return new_params
 
     @app.template_filter('new_dsp_type')
     def new_dsp_type(params, type):
         new_params = params.copy()
         new_params["dsp_type"] = type
-        if "start" in params:
-            del new_params["start"]
+        if "cursor" in params:
+            del new_params["cursor"]
         if "npp" in params:
             del new_params["npp"]
         return new_params
@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+"""
+Copyright (c) 2019 - present AppSeed.us
+"""
+import csv
+import io
+
+import orjson
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+from app.api import blueprint
+from app.models.activity import Result
+from app.query import parse_query
+from app.search import RESULT_COLUMNS, search
+from app.suggest import MAX_SUGGESTIONS, refresh_vocabulary, suggest
+
+# Rows fetched from the database (and written to the client) per round trip
+STREAM_BATCH_SIZE = 1000
+
+BASE_FIELDS = ["id", "date", "type", "source", "last_updated"]
+
+
+def iter_rows(q):
+    return q.with_entities(*RESULT_COLUMNS)\
+            .execution_options(stream_results=True)\
+            .yield_per(STREAM_BATCH_SIZE)
+
+
+def row_fields(row):
+    return [
+        row.id,
+        row.date.isoformat() if row.date else "",
+        row.type,
+        row.source,
+        row.last_updated.isoformat() if row.last_updated else "",
+    ]
+
+
+def ndjson_lines(q):
+    batch = []
+    for row in iter_rows(q):
+        record = orjson.loads(row.details) if row.details else {}
+        record.update(zip(BASE_FIELDS, row_fields(row)))
+        batch.append(orjson.dumps(record))
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def csv_lines(q, data_type):
+    """
+    With a single type every row has the same details keys, so they get
+    their own columns. Mixed types carry the details JSON in one column.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    detail_keys = None
+    n = 0
+    for row in iter_rows(q):
+        details = row.details or "{}"
+        if detail_keys is None:
+            if data_type:
+                detail_keys = list(orjson.loads(details).keys())
+            else:
+                detail_keys = []
+            writer.writerow(BASE_FIELDS + (detail_keys or ["details"]))
+
+        if detail_keys:
+            record = orjson.loads(details)
+            writer.writerow(row_fields(row) + [record.get(k, "") for k in detail_keys])
+        else:
+            writer.writerow(row_fields(row) + [details])
+
+        n += 1
+        if n % STREAM_BATCH_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    if detail_keys is None:
+        writer.writerow(BASE_FIELDS + ["details"])
+    yield buf.getvalue()
+
+
+@blueprint.route('/search')
+def api_search():
+    """
+    Stream every result matching gquery as NDJSON (default) or CSV.
+
+    Takes the same gquery syntax as /index, plus an optional `type` to
+    restrict the export to one result type.
+    """
+    node = parse_query(request.args.get("gquery", ""))
+    data_type = request.args.get("type")
+    fmt = request.args.get("format", "ndjson").lower()
+
+    q, ranked = search(Result.query, node)
+    if data_type:
+        q = q.filter(Result.type == data_type)
+
+    if fmt == "csv":
+        body = csv_lines(q, data_type)
+        mimetype = "text/csv"
+    elif fmt == "ndjson":
+        body = ndjson_lines(q)
+        mimetype = "application/x-ndjson"
+    else:
+        return jsonify(error=f"Unsupported format: {fmt}"), 400
+
+    return Response(stream_with_context(body), mimetype=mimetype)
+
+
+@blueprint.route('/suggest')
+def api_suggest():
+    """Most common tag keywords starting with the last word of `prefix`."""
+    refresh_vocabulary(current_app._get_current_object())
+    prefix = request.args.get("prefix", "")
+    limit = request.args.get("limit", MAX_SUGGESTIONS, type=int)
+    limit = max(0, min(limit, MAX_SUGGESTIONS))
+    return jsonify(
+        prefix=prefix,
+        suggestions=[
+            {"keyword": keyword, "count": df}
+            for keyword, df in suggest(prefix, limit)
+        ]
+    )
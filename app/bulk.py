@@ -0,0 +1,146 @@
+"""
+Bulk write path for publishing.
+
+BulkWriter buffers plain rows and writes them in batches with a Core
+executemany, or COPY on PostgreSQL, instead of going through the ORM
+session. Only one batch is held in memory at a time; the database
+transaction holds the rest until the caller commits.
+
+Result ids are allocated by the writer from max(results.id) so that the
+attrs and tags of a result can be written in the same batch. That relies
+on there being a single writer per transaction: within a process the
+publishing pipeline guarantees it with app.ingest.WRITE_LOCK, and across
+processes the writer locks the results table before reading max(results.id)
+(SHARE ROW EXCLUSIVE on PostgreSQL, SQLite's write lock), which holds off
+every other writer until the transaction ends. max(results.id) is read
+again for every transaction as other writers may have committed in between.
+"""
+import datetime
+import io
+
+from sqlalchemy import func, text
+
+from app.models.activity import LocalFile, Result, ResultAttr, Tag
+
+RESULT_COLUMNS = ["id", "date", "type", "source", "tags", "last_updated", "details"]
+ATTR_COLUMNS = ["result_id", "key", "value"]
+TAG_COLUMNS = ["result_id", "keyword"]
+FILE_COLUMNS = ["file_path", "file_hash", "date_parsed"]
+
+
+def copy_value(value):
+    """value in PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat(" ")
+    return str(value).replace("\\", "\\\\")\
+                     .replace("\t", "\\t")\
+                     .replace("\n", "\\n")\
+                     .replace("\r", "\\r")
+
+
+class BulkWriter(object):
+    def __init__(self, db, batch_size=5000):
+        self.db = db
+        self.batch_size = batch_size
+        self.postgresql = db.engine.dialect.name == "postgresql"
+        self.next_id = None
+        self.allocated = False
+        # Parents first so foreign keys are satisfied within a flush
+        self.buffers = [
+            (Result.__table__, RESULT_COLUMNS, []),
+            (ResultAttr.__table__, ATTR_COLUMNS, []),
+            (Tag.__table__, TAG_COLUMNS, []),
+            (LocalFile.__table__, FILE_COLUMNS, []),
+        ]
+        self.results, self.attrs, self.tags, self.files = [b[2] for b in self.buffers]
+
+    def allocate_id(self):
+        if self.next_id is None:
+            self.lock_results()
+            max_id = self.db.session.query(func.max(Result.id)).scalar()
+            self.next_id = (max_id or 0) + 1
+        result_id = self.next_id
+        self.next_id += 1
+        self.allocated = True
+        return result_id
+
+    def lock_results(self):
+        if self.postgresql:
+            stmt = "LOCK TABLE results IN SHARE ROW EXCLUSIVE MODE"
+        else:
+            # Any write statement takes SQLite's RESERVED lock until commit
+            stmt = "UPDATE results SET id = id WHERE 0"
+        self.db.session.execute(text(stmt))
+
+    def add_result(self, date, type, source, tags, details, attrs=(), last_updated=None):
+        """Queue a result and its (key, value) attrs. Returns its id."""
+        result_id = self.allocate_id()
+        self.results.append((result_id, date, type, source, tags,
+                             last_updated or datetime.datetime.now(), details))
+        self.add_attrs(result_id, attrs)
+        return result_id
+
+    def add_attrs(self, result_id, attrs):
+        self.attrs.extend((result_id, key, value) for key, value in attrs)
+        self.maybe_flush()
+
+    def add_tags(self, result_id, keywords):
+        self.tags.extend((result_id, keyword) for keyword in keywords)
+        self.maybe_flush()
+
+    def add_file(self, file_path, file_hash, date_parsed=None):
+        self.files.append((file_path, file_hash, date_parsed or datetime.datetime.now()))
+        self.maybe_flush()
+
+    def pending(self):
+        return sum(len(rows) for _, _, rows in self.buffers)
+
+    def maybe_flush(self):
+        if self.pending() >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered row; nothing is committed."""
+        for table, columns, rows in self.buffers:
+            if not rows:
+                continue
+            if self.postgresql:
+                self.copy(table, columns, rows)
+            else:
+                self.db.session.execute(
+                    table.insert(),
+                    [dict(zip(columns, row)) for row in rows]
+                )
+            del rows[:]
+
+    def copy(self, table, columns, rows):
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(copy_value(value) for value in row))
+            buf.write("\n")
+        buf.seek(0)
+        cursor = self.db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN".format(table.name, ", ".join(columns)),
+                buf
+            )
+        finally:
+            cursor.close()
+
+    def commit(self):
+        self.flush()
+        self.sync_sequence()
+        self.db.session.commit()
+        self.next_id = None
+
+    def sync_sequence(self):
+        # Explicit ids don't advance PostgreSQL's serial sequence
+        if self.postgresql and self.allocated:
+            self.db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('results', 'id'), "
+                "(SELECT max(id) FROM results))"
+            ))
+            self.allocated = False
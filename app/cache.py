@@ -0,0 +1,119 @@
+"""
+Search result cache.
+
+Entries live in an in-process LRU with a TTL. When SEARCH_CACHE_PATH is set
+they are also written to a local sqlite file so every gunicorn worker on the
+host can reuse them. Keys include the publish generation (see
+app.models.activity.Generation), so a publish invalidates everything cached
+before it without having to clear anything.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+
+# Expired rows are purged from the shared store every this many writes
+PURGE_EVERY = 100
+
+
+class QueryCache(object):
+    def __init__(self, max_size=1024, ttl=300, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+
+    def init_app(self, app):
+        self.max_size = app.config.get("SEARCH_CACHE_SIZE", self.max_size)
+        self.ttl = app.config.get("SEARCH_CACHE_TTL", self.ttl)
+        self.path = app.config.get("SEARCH_CACHE_PATH", self.path)
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def _shared(self):
+        # sqlite connections must not cross a fork, so open one per process
+        if not self.path:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=5,
+                                         check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                "key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+            try:
+                conn = self._shared()
+                row = conn and conn.execute(
+                    "SELECT value, expires FROM query_cache WHERE key = ?",
+                    (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"Query cache read failed: {e}")
+                row = None
+            if row is None or row[1] <= now:
+                return None
+            value = orjson.loads(row[0])
+            self._remember(key, row[1], value)
+            return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires, value)
+            try:
+                conn = self._shared()
+                if conn is None:
+                    return
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, value, expires) "
+                    "VALUES (?, ?, ?)",
+                    (key, orjson.dumps(value), expires)
+                )
+                self._writes += 1
+                if self._writes % PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM query_cache WHERE expires <= ?",
+                                 (time.time(),))
+            except sqlite3.Error as e:
+                print(f"Query cache write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, expires, value):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+query_cache = QueryCache()
@@ -1,20 +1,67 @@
 import datetime
-import glob
 import json
 import os
 import re
-import xmltodict
-import string
 from dateutil import parser
 import sys
 import hashlib
-
-from app.models.activity import Result, Tag, LocalFile
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import compress, repeat
+from flask import current_app
+from sqlalchemy import Integer, bindparam, cast, func, inspect, select
+
+from app.bulk import BulkWriter
+from app.columnar import (
+    block_lines,
+    convert,
+    distinct,
+    encode_column,
+    joined_rows,
+    json_template,
+    read_block,
+    split_columns,
+    valid_lines,
+)
+from app.fec import official_name
+from app.fts import sync_fts
+from app.lda import read_filing, text
+from app.ingest import (
+    PARSE_STATS,
+    WRITE_LOCK,
+    ResultRow,
+    chunk_tasks,
+    file_tasks,
+    make_row,
+    publish_tasks,
+    resume_offsets,
+    shared_pool,
+)
+from app.models.activity import (
+    INDEXED_ATTRS,
+    FileManifest,
+    Generation,
+    KeywordStat,
+    LocalFile,
+    Result,
+    ResultAttr,
+    Tag,
+    attr_pairs,
+    normalize_attr,
+)
+from app.sources import list_sources, member_fingerprints, open_source, source_name
+from app.util import tokenize_tags
 
 
 DATE_FMT = "%m/%d/%Y, %H:%M:%S"
 
-FILE_BUF_SIZE = 65536
+FILE_BUF_SIZE = 1 << 20
+
+# Values bound per IN (...) clause
+IN_BATCH_SIZE = 500
 
 FILE_HASH_CACHE = {}
 
@@ -22,9 +69,9 @@ FILE_HASH_CACHE = {}
 def get_files(source_dir, filename_regexs):
     valid = []
     invalid = []
-    for filepath in glob.glob(os.path.join(source_dir, "**"), recursive=True):
+    for filepath in list_sources(source_dir):
         if any(
-            re.match(pattern, os.path.basename(filepath))
+            re.match(pattern, source_name(filepath))
             for pattern in filename_regexs
         ):
             valid.append(filepath)
@@ -42,628 +89,867 @@ def hash_file(filepath):
             md5.update(data)
     return md5.hexdigest()
 
-def get_new_files(filepaths):
+def get_new_files(db, filepaths):
+    """
+    The files that have not been published with their current contents.
+
+    A file is only hashed when its size or mtime differ from the manifest,
+    and the manifest and LocalFile are each read with one query covering
+    every file's common directory. Zip members are never hashed; their CRC
+    and size identify their contents.
+    """
+    if not filepaths:
+        return []
+
+    prefix = os.path.commonpath(filepaths)
+    with WRITE_LOCK:
+        FileManifest.__table__.create(db.engine, checkfirst=True)
+        manifest = {
+            file_path: (file_size, file_mtime_ns, file_hash)
+            for file_path, file_size, file_mtime_ns, file_hash in db.session.query(
+                FileManifest.file_path,
+                FileManifest.file_size,
+                FileManifest.file_mtime_ns,
+                FileManifest.file_hash
+            ).filter(FileManifest.file_path.startswith(prefix, autoescape=True))
+        }
+        parsed = set(
+            db.session.query(LocalFile.file_path, LocalFile.file_hash)
+                      .filter(LocalFile.file_path.startswith(prefix, autoescape=True))
+        )
+        db.session.commit()
+
+    members = member_fingerprints(filepaths)
     new_files = []
+    changed = []
     for filepath in filepaths:
-        hash_code = hash_file(filepath)
-        if LocalFile.query.filter(LocalFile.file_path==filepath)\
-                          .filter(LocalFile.file_hash==hash_code)\
-                          .count() == 0:
+        if filepath in members:
+            hash_code = members[filepath]
+            if (filepath, hash_code) not in parsed:
+                new_files.append(filepath)
+                FILE_HASH_CACHE[filepath] = hash_code
+            continue
+        st = os.stat(filepath)
+        entry = manifest.get(filepath)
+        if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+            hash_code = entry[2]
+        else:
+            hash_code = hash_file(filepath)
+            changed.append({
+                "file_path": filepath,
+                "file_size": st.st_size,
+                "file_mtime_ns": st.st_mtime_ns,
+                "file_hash": hash_code,
+            })
+
+        if (filepath, hash_code) not in parsed:
             new_files.append(filepath)
             FILE_HASH_CACHE[filepath] = hash_code
-        else:
-            print(f"Already parsed {filepath}")
-    return new_files
-
-
-def create_result(info):
-    return Result(
-        date=info["date"],
-        type=info["type"],
-        source=info["source"],
-        tags=info["tags"],
-        last_updated=info["last_updated"],
-        details=info["details"]
-    )
-
-
-def publish_ld1s(db, source_dir, id_maps):
-    filepaths, invalid_filepaths = get_files(source_dir, [r"\d+.xml"])
-    assert filepaths, "No files found"
-
-    filepaths = get_new_files(filepaths)
-
-    print("The following files were invald:")
-    for filepath in invalid_filepaths:
-        print(f"    -{filepath}")
-
-    n = 0
-    for filepath in filepaths:
-        with open(filepath, "r") as f:
-            try:
-                doc = xmltodict.parse(f.read())
-                info = json.loads(json.dumps(doc))["LOBBYINGDISCLOSURE1"]
 
-                # Figure out the date
-                try:
-                    date_info = info["effectiveDate"]
-                    date = parser.parse(date_info)
-                except Exception:
-                    try:
-                        date_info = info["signedDate"]
-                        date = parser.parse(date_info)
-                    except Exception as e:
-                        print(f"Unable to determine date for {filepath}")
-                        print(e)
-                        date_info = "01011900"
-                        date = datetime.datetime.strptime(date_info, "%m%d%Y")
-
-                base_info = {
-                    "form_id": os.path.basename(filepath).split('.')[0],
-                    "client": info["clientName"],
-                    "senate_id": info["senateID"] or "",
-                    "house_id": info["houseID"] or "",
-                    "specific_issues": info["specific_issues"],
-                    "date": date.strftime(DATE_FMT)
-                }
-
-                for lobbyist_info in info["lobbyists"].get("lobbyist", []):
-                    person_info = {}
-                    name = " ".join(
-                        lobbyist_info[name_part]
-                        for name_part in ["lobbyistFirstName", "lobbyistLastName", "lobbyistSuffix"]
-                        if lobbyist_info[name_part] is not None
-                    )
-                    if not name:
-                        continue
-                    person_info["name"] = name
-                    person_info["covered_positions"] = lobbyist_info["coveredPosition"] or ""
-
-                    if info["organizationName"] is not None:
-                        person_info["registrant"] = info["organizationName"]
-                    else:
-                        person_info["registrant"] = person_info["name"]
-
-                    tags = list(base_info.values()) + list(person_info.values())
-                    tags.extend([
-                        info["registrantGeneralDescription"] or "",
-                        info["clientGeneralDescription"] or "",
-                        "ld1", "ld-1", "ld",
-                        "lobby filing",
-                        "registration"
-                    ])
-
-                    details = {
-                        "form_id": base_info["form_id"],
-                        "registrant": person_info["registrant"],
-                        "client": base_info["client"],
-                        "senate_id": base_info["senate_id"],
-                        "house_id": base_info["house_id"],
-                        "lobbyist_name": person_info["name"],
-                        "specific_issues": base_info["specific_issues"],
-                        "covered_positions": person_info["covered_positions"]
-                    }
+    table = FileManifest.__table__
+    with WRITE_LOCK:
+        for i in range(0, len(changed), IN_BATCH_SIZE):
+            batch = changed[i:i + IN_BATCH_SIZE]
+            db.session.execute(table.delete().where(
+                table.c.file_path.in_([row["file_path"] for row in batch])
+            ))
+            db.session.execute(table.insert(), batch)
+        db.session.commit()
 
-                    final_info = {
-                        "date": date,
-                        "type": "ld1",
-                        "source": "https://disclosurespreview.house.gov/ld/ldxmlrelease/{}/{}/{}".format(
-                            info["reportYear"],
-                            info["reportType"],
-                            os.path.basename(filepath)
-                        ),
-                        "tags": ",".join(tags),
-                        "details": json.dumps(details),
-                        "last_updated": datetime.datetime.now(),
-                    }
+    print(f"Hashed {len(changed)} of {len(filepaths) - len(members)} files "
+          f"({len(members)} archive members), "
+          f"{len(filepaths) - len(new_files)} already parsed")
+    return new_files
 
-                    db.session.add(create_result(final_info))
 
-                    n += 1
-                    if n % 1000 == 0:
-                        print(f"Parsed {n} records")
+def bump_generation(db):
+    """Mark everything derived from the previous contents as stale."""
+    Generation.__table__.create(db.engine, checkfirst=True)
+    row = Generation.query.get(1)
+    if row is None:
+        row = Generation(id=1, generation=0)
+        db.session.add(row)
+    row.generation += 1
+    row.last_updated = datetime.datetime.now()
+    db.session.commit()
+    print(f"Data generation is now {row.generation}")
 
-            except Exception as e:
-                print(f"Failed to parse file {filepath}")
-                print(e)
-                raise
-                continue
-        db.session.add(LocalFile(file_path=filepath,
-                                 file_hash=FILE_HASH_CACHE[filepath],
-                                 date_parsed=datetime.datetime.now()))
 
-    db.session.commit()
-    print(f"Uploaded {n} records")
+def publish_complete(db):
+    """Bring derived search structures up to date after a publish."""
+    with WRITE_LOCK:
+        create_indexes(db)
+        if current_app.config.get("SEARCH_BACKEND") == "fts":
+            sync_fts(db)
+        if db.session.query(Tag.id).first() is not None:
+            # Searches use the tag index once tag-db has built it
+            publish_tags(db)
+        # Results from before result_attrs existed
+        publish_attrs(db)
+        bump_generation(db)
 
 
-def publish_ld2s(db, source_dir, id_maps):
-    filepaths, invalid_filepaths = get_files(source_dir, [r"\d+.xml"])
+def new_files(db, source_dir, filename_regexs):
+    filepaths, invalid_filepaths = get_files(source_dir, filename_regexs)
     assert filepaths, "No files found"
 
-    filepaths = get_new_files(filepaths)
+    filepaths = get_new_files(db, filepaths)
 
     print("The following files were invald:")
     for filepath in invalid_filepaths:
         print(f"    -{filepath}")
-
-    failed = []
-
-    n = 0
-    for filepath in filepaths:
-        with open(filepath, "r") as f:
+    return filepaths
+
+
+# Date formats the sources use, parsed without dateutil: LD effective and
+# contribution dates (01/31/2019), LD signed dates (01/31/2019 11:59:59 PM)
+# and congress vote times (2019-01-31T23:59:59-05:00)
+MDY_DATE_RE = re.compile(
+    r"(\d{1,2})/(\d{1,2})/(\d{4})(?: (\d{1,2}):(\d{2}):(\d{2}) ([AP]M))?$"
+)
+ISO_DATE_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:([+-])(\d{2}):(\d{2})|(Z))?$"
+)
+
+
+def mdy_date(m):
+    month, day, year, hour, minute, second, half = m.groups()
+    if hour is None:
+        return datetime.datetime(int(year), int(month), int(day))
+    hour = int(hour)
+    if not 1 <= hour <= 12:
+        return None
+    hour = hour % 12 + (12 if half == "PM" else 0)
+    return datetime.datetime(int(year), int(month), int(day), hour, int(minute), int(second))
+
+
+def iso_date(m):
+    year, month, day, hour, minute, second, sign, tz_hours, tz_minutes, utc = m.groups()
+    tz = None
+    if utc:
+        tz = datetime.timezone.utc
+    elif sign:
+        offset = datetime.timedelta(hours=int(tz_hours), minutes=int(tz_minutes))
+        tz = datetime.timezone(-offset if sign == "-" else offset)
+    return datetime.datetime(int(year), int(month), int(day),
+                             int(hour), int(minute), int(second), tzinfo=tz)
+
+
+DATE_FAST_PATHS = [
+    (MDY_DATE_RE, mdy_date),
+    (ISO_DATE_RE, iso_date),
+]
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_date(value):
+    """
+    value parsed as dateutil's parser.parse would, through the fast path of
+    a known format when one matches. Anything else goes to dateutil and is
+    counted in the publish's parse stats.
+    """
+    for regex, build in DATE_FAST_PATHS:
+        m = regex.match(value)
+        if m:
             try:
-                doc = xmltodict.parse(f.read())
-                info = json.loads(json.dumps(doc))["LOBBYINGDISCLOSURE2"]
-
-                # Figure out the date
-                try:
-                    # TODO: LD-2s don't have effective date
-                    date_info = info["effectiveDate"]
-                    date = parser.parse(date_info)
-                except Exception:
-                    try:
-                        date_info = info["signedDate"]
-                        date = parser.parse(date_info)
-                    except Exception as e:
-                        print(f"Unable to determine date for {filepath}")
-                        print(e)
-                        date_info = "01011900"
-                        date = datetime.datetime.strptime(date_info, "%m%d%Y")
-
-                alis = info["alis"]["ali_info"]
-                if isinstance(alis, dict):
-                    alis = [alis]
-
-                for ali in alis:
-                    base_info = {
-                        "form_id": os.path.basename(filepath).split('.')[0],
-                        "client": info["clientName"],
-                        "income": info["income"],
-                        "expenses": info["expenses"],
-                        "termination_date": info["terminationDate"],
-                        "senate_id": info["senateID"] or "",
-                        "house_id": info["houseID"] or "",
-                        "issue_code": ali["issueAreaCode"],
-                        "specific_issues": ali["specific_issues"]["description"],
-                        "federal_agencies": ali.get("federal_agencies", ""),
-                        "date": date.strftime(DATE_FMT)
-                    }
-
-                    lobbyist_names = []
-                    for lobbyist_info in ali["lobbyists"].get("lobbyist", []):
-                        name = " ".join(
-                            lobbyist_info[name_part]
-                            for name_part in ["lobbyistFirstName", "lobbyistLastName", "lobbyistSuffix"]
-                            if lobbyist_info[name_part] is not None
-                        )
-                        if not name:
-                            continue
-                        lobbyist_names.append(name)
-
-                    base_info["lobbyist_names"] = ",".join(lobbyist_names)
-
-                    if info["organizationName"] is not None:
-                        base_info["registrant"] = info["organizationName"]
-                    elif lobbyist_names:
-                        base_info["registrant"] = lobbyist_names[0]
-                    elif info["printedName"] is not None:
-                        base_info["registrant"] = info["printedName"]
-                    else:
-                        base_info["registrant"] = "[No-Name]"
-
-
-                    tags = list(base_info.values())
-                    tags.extend([
-                        "ld2", "ld-2", "ld",
-                        "lobby filing",
-                        "registration"
-                    ])
-
-                    details = {
-                        "form_id": base_info["form_id"],
-                        "registrant": base_info["registrant"],
-                        "client": base_info["client"],
-                        "senate_id": base_info["senate_id"],
-                        "house_id": base_info["house_id"],
-                        "lobbyist_names": base_info["lobbyist_names"],
-                        "specific_issues": base_info["specific_issues"],
-                        "income": base_info["income"],
-                        "expenses": base_info["expenses"],
-                        "termination_date": base_info["termination_date"],
-                        "issue_code": base_info["issue_code"],
-                        "federal_agencies": base_info["federal_agencies"],
-                    }
-
-                    final_info = {
-                        "date": date,
-                        "type": "ld2",
-                        "source": "https://disclosurespreview.house.gov/ld/ldxmlrelease/{}/{}/{}".format(
-                            info["reportYear"],
-                            info["reportType"],
-                            os.path.basename(filepath)
-                        ),
-                        "tags": ",".join([t for t in tags if t is not None]),
-                        "details": json.dumps(details),
-                        "last_updated": datetime.datetime.now(),
-                    }
-
-                    db.session.add(create_result(final_info))
-                    n += 1
-
-
+                date = build(m)
+            except ValueError:
+                date = None
+            if date is not None:
+                return date
+    PARSE_STATS["dates parsed by dateutil"] += 1
+    return parser.parse(value)
+
+
+def parse_ld1_file(filepath, id_maps):
+    rows = []
+    try:
+        with open_source(filepath) as f:
+            info = read_filing(f, "LOBBYINGDISCLOSURE1")
+
+        # Figure out the date
+        try:
+            date_info = info["effectiveDate"]
+            date = parse_date(date_info)
+        except Exception:
+            try:
+                date_info = info["signedDate"]
+                date = parse_date(date_info)
             except Exception as e:
-                #print(f"Failed to parse file {filepath}")
+                print(f"Unable to determine date for {filepath}")
                 print(e)
-                #raise
-                failed.append(filepath)
+                date_info = "01011900"
+                date = datetime.datetime.strptime(date_info, "%m%d%Y")
+
+        base_info = {
+            "form_id": source_name(filepath).split('.')[0],
+            "client": info["clientName"],
+            "senate_id": info["senateID"] or "",
+            "house_id": info["houseID"] or "",
+            "specific_issues": text(info["specific_issues"]),
+            "date": date.strftime(DATE_FMT)
+        }
+
+        for lobbyist_info in info.get("lobbyist", []):
+            person_info = {}
+            name = " ".join(
+                lobbyist_info[name_part]
+                for name_part in ["lobbyistFirstName", "lobbyistLastName", "lobbyistSuffix"]
+                if lobbyist_info.get(name_part) is not None
+            )
+            if not name:
                 continue
-        db.session.add(LocalFile(file_path=filepath,
-                                 file_hash=FILE_HASH_CACHE[filepath],
-                                 date_parsed=datetime.datetime.now()))
+            person_info["name"] = name
+            person_info["covered_positions"] = lobbyist_info.get("coveredPosition") or ""
+
+            if info["organizationName"] is not None:
+                person_info["registrant"] = info["organizationName"]
+            else:
+                person_info["registrant"] = person_info["name"]
+
+            tags = list(base_info.values()) + list(person_info.values())
+            tags.extend([
+                info["registrantGeneralDescription"] or "",
+                info["clientGeneralDescription"] or "",
+                "ld1", "ld-1", "ld",
+                "lobby filing",
+                "registration"
+            ])
+
+            details = {
+                "form_id": base_info["form_id"],
+                "registrant": person_info["registrant"],
+                "client": base_info["client"],
+                "senate_id": base_info["senate_id"],
+                "house_id": base_info["house_id"],
+                "lobbyist_name": person_info["name"],
+                "specific_issues": base_info["specific_issues"],
+                "covered_positions": person_info["covered_positions"]
+            }
+
+            rows.append(make_row(
+                date,
+                "ld1",
+                "https://disclosurespreview.house.gov/ld/ldxmlrelease/{}/{}/{}".format(
+                    info["reportYear"],
+                    info["reportType"],
+                    source_name(filepath)
+                ),
+                ",".join(tags),
+                details
+            ))
+
+    except Exception as e:
+        print(f"Failed to parse file {filepath}")
+        print(e)
+        raise
+    return rows, True
 
-        if n % 1000 == 0:
-            print(f"Parsed {n} records")
-            db.session.commit()
-
-    db.session.commit()
-    print("Failed to parse the following:")
-    for f in failed:
-        print(f)
-    print(f"Uploaded {n} records")
 
+def publish_ld1s(db, source_dir, id_maps):
+    filepaths = new_files(db, source_dir, [r"\d+.xml"])
+    publish_tasks(db, file_tasks(parse_ld1_file, filepaths), id_maps, FILE_HASH_CACHE)
+    publish_complete(db)
+
+
+def parse_ld2_file(filepath, id_maps):
+    rows = []
+    try:
+        with open_source(filepath) as f:
+            info = read_filing(f, "LOBBYINGDISCLOSURE2")
+
+        # Figure out the date
+        try:
+            # TODO: LD-2s don't have effective date
+            date_info = info["effectiveDate"]
+            date = parse_date(date_info)
+        except Exception:
+            try:
+                date_info = info["signedDate"]
+                date = parse_date(date_info)
+            except Exception as e:
+                print(f"Unable to determine date for {filepath}")
+                print(e)
+                date_info = "01011900"
+                date = datetime.datetime.strptime(date_info, "%m%d%Y")
+
+        for ali in info.get("ali_info", []):
+            base_info = {
+                "form_id": source_name(filepath).split('.')[0],
+                "client": info["clientName"],
+                "income": info["income"],
+                "expenses": info["expenses"],
+                "termination_date": info["terminationDate"],
+                "senate_id": info["senateID"] or "",
+                "house_id": info["houseID"] or "",
+                "issue_code": ali["issueAreaCode"],
+                "specific_issues": text(ali.get("description")),
+                "federal_agencies": text(ali.get("federal_agencies", "")),
+                "date": date.strftime(DATE_FMT)
+            }
+
+            lobbyist_names = []
+            for lobbyist_info in ali.get("lobbyist", []):
+                name = " ".join(
+                    lobbyist_info[name_part]
+                    for name_part in ["lobbyistFirstName", "lobbyistLastName", "lobbyistSuffix"]
+                    if lobbyist_info.get(name_part) is not None
+                )
+                if not name:
+                    continue
+                lobbyist_names.append(name)
+
+            base_info["lobbyist_names"] = ",".join(lobbyist_names)
+
+            if info["organizationName"] is not None:
+                base_info["registrant"] = info["organizationName"]
+            elif lobbyist_names:
+                base_info["registrant"] = lobbyist_names[0]
+            elif info["printedName"] is not None:
+                base_info["registrant"] = info["printedName"]
+            else:
+                base_info["registrant"] = "[No-Name]"
+
+
+            tags = list(base_info.values())
+            tags.extend([
+                "ld2", "ld-2", "ld",
+                "lobby filing",
+                "registration"
+            ])
+
+            details = {
+                "form_id": base_info["form_id"],
+                "registrant": base_info["registrant"],
+                "client": base_info["client"],
+                "senate_id": base_info["senate_id"],
+                "house_id": base_info["house_id"],
+                "lobbyist_names": base_info["lobbyist_names"],
+                "specific_issues": base_info["specific_issues"],
+                "income": base_info["income"],
+                "expenses": base_info["expenses"],
+                "termination_date": base_info["termination_date"],
+                "issue_code": base_info["issue_code"],
+                "federal_agencies": base_info["federal_agencies"],
+            }
+
+            rows.append(make_row(
+                date,
+                "ld2",
+                "https://disclosurespreview.house.gov/ld/ldxmlrelease/{}/{}/{}".format(
+                    info["reportYear"],
+                    info["reportType"],
+                    source_name(filepath)
+                ),
+                ",".join([t for t in tags if t is not None]),
+                details
+            ))
+
+    except Exception as e:
+        #print(f"Failed to parse file {filepath}")
+        print(e)
+        return [], False
+    return rows, True
 
-def publish_ld203s(db, source_dir, id_maps):
-    filepaths, invalid_filepaths = get_files(source_dir, [r"\d+.xml"])
-    assert filepaths, "No files found"
 
-    filepaths = get_new_files(filepaths)
+def publish_ld2s(db, source_dir, id_maps):
+    filepaths = new_files(db, source_dir, [r"\d+.xml"])
+    publish_tasks(db, file_tasks(parse_ld2_file, filepaths), id_maps, FILE_HASH_CACHE)
+    publish_complete(db)
+
+
+def parse_ld203_file(filepath, id_maps):
+    rows = []
+    try:
+        with open_source(filepath) as f:
+            info = read_filing(f, "CONTRIBUTIONDISCLOSURE")
+        if info["noContributions"] is not None and info["noContributions"].lower() == "true":
+            return rows, True
+
+        base_info = {
+            "form_id": source_name(filepath).split('.')[0],
+            "client": info["organizationName"],
+            "senate_id": info["senateRegID"],
+            "house_id": info["houseRegID"],
+        }
+        base_info["lobbyist"] = " ".join(
+            info[name_part]
+            for name_part in ["lobbyistFirstName", "lobbyistMiddleName", "lobbyistLastName", "lobbyistSuffix"]
+            if info[name_part] is not None
+        )
 
-    print("The following files were invald:")
-    for filepath in invalid_filepaths:
-        print(f"    -{filepath}")
+        if not info.get("contribution"):
+            raise Exception("No contributions")
 
-    n = 1
-    for filepath in filepaths:
-        with open(filepath, "r") as f:
+        for contribution in info["contribution"]:
+            if contribution["date"] is None:
+                continue
+            contribution_info = {
+                "type": contribution["type"],
+                "amount": contribution["amount"].replace(",", ""),
+                "contributor_name": contribution["contributorName"],
+                "recipient_name": contribution["recipientName"],
+                "date": contribution["date"],
+            }
+
+            tags = list(contribution_info.values()) + list(base_info.values())
+            tags.extend([
+                contribution["payeeName"],
+                "ld203", "ld-203",
+                "lobby filing",
+                "contribution"
+            ])
+
+            # Figure out the date
             try:
-                doc = xmltodict.parse(f.read())
-                info = json.loads(json.dumps(doc))["CONTRIBUTIONDISCLOSURE"]
-                if info["noContributions"] is not None and info["noContributions"].lower() == "true":
-                    continue
-
-                base_info = {
-                    "form_id": os.path.basename(filepath).split('.')[0],
-                    "client": info["organizationName"],
-                    "senate_id": info["senateRegID"],
-                    "house_id": info["houseRegID"],
-                }
-                base_info["lobbyist"] = " ".join(
-                    info[name_part]
-                    for name_part in ["lobbyistFirstName", "lobbyistMiddleName", "lobbyistLastName", "lobbyistSuffix"]
-                    if info[name_part] is not None
-                )
+                date_info = contribution_info["date"]
+                date = parse_date(date_info)
+            except Exception:
+                try:
+                    date_info = base_info["signedDate"]
+                    date = parse_date(date_info)
+                except Exception as e:
+                    print(f"Unable to determine date for {filepath}")
+                    print(e)
+                    date_info = "01011900"
+                    date = datetime.datetime.strptime(date_info, "%m%d%Y")
+
+            details = {
+                "form_id": base_info["form_id"],
+                "client": base_info["client"],
+                "senate_id": base_info["senate_id"],
+                "house_id": base_info["house_id"],
+                "lobbyist": base_info["lobbyist"],
+                "contribution_type": contribution_info["type"],
+                "amount": contribution_info["amount"],
+                "contributor_name": contribution_info["contributor_name"],
+                "recipient_name": contribution_info["recipient_name"],
+            }
+
+            rows.append(make_row(
+                date,
+                "ld203",
+                "https://disclosurespreview.house.gov/lc/lcxmlrelease/{}/{}/{}".format(
+                    info["reportYear"],
+                    info["reportType"],
+                    source_name(filepath)
+                ),
+                ",".join(tags),
+                details
+            ))
+
+    except Exception as e:
+        print(f"Failed to parse file {filepath}")
+        print(e)
+        return [], False
+    return rows, True
 
-                if info["contributions"] is None:
-                    raise Exception("No contributions")
-
-                if isinstance(info["contributions"]["contribution"], dict):
-                    contributions = [info["contributions"]["contribution"]]
-                else:
-                    contributions = info["contributions"]["contribution"]
-
-                for contribution in contributions:
-                    if contribution["date"] is None:
-                        continue
-                    contribution_info = {
-                        "type": contribution["type"],
-                        "amount": contribution["amount"].replace(",", ""),
-                        "contributor_name": contribution["contributorName"],
-                        "recipient_name": contribution["recipientName"],
-                        "date": contribution["date"],
-                    }
 
-                    tags = list(contribution_info.values()) + list(base_info.values())
+def publish_ld203s(db, source_dir, id_maps):
+    filepaths = new_files(db, source_dir, [r"\d+.xml"])
+    publish_tasks(db, file_tasks(parse_ld203_file, filepaths), id_maps, FILE_HASH_CACHE)
+    publish_complete(db)
+
+
+def parse_congress_vote_file(filepath, id_maps):
+    rows = []
+    with open_source(filepath) as f:
+        try:
+            info = json.load(f)
+
+            session_info = {
+                "vote_id": info["vote_id"],
+                "chamber": "house" if info["chamber"].lower() == "h" else "senate",
+                "result": info["result"],
+                "category": info["category"],
+                "memo": info["question"]
+            }
+            if "bill" in info:
+                session_info["bill_id"] = "{}{}-{}".format(info["bill"]["type"],
+                                                           info["bill"]["number"],
+                                                           info["bill"]["congress"])
+
+            date = parse_date(info["date"])
+            for vote_status in info["votes"]:
+                for vote_info in info["votes"][vote_status]:
+                    tags = list(session_info.values()) + list(vote_info.values())
                     tags.extend([
-                        contribution["payeeName"],
-                        "ld203", "ld-203",
-                        "lobby filing",
-                        "contribution"
+                        "vote",
+                        "congress",
+                        vote_status,
+                        info.get("subject", "")
+
                     ])
 
-                    # Figure out the date
-                    try:
-                        date_info = contribution_info["date"]
-                        date = parser.parse(date_info)
-                    except Exception:
-                        try:
-                            date_info = base_info["signedDate"]
-                            date = parser.parse(date_info)
-                        except Exception as e:
-                            print(f"Unable to determine date for {filepath}")
-                            print(e)
-                            date_info = "01011900"
-                            date = datetime.datetime.strptime(date_info, "%m%d%Y")
+                    cand_id = vote_info["id"]
+                    if cand_id in id_maps["bioguide"]:
+                        tags.extend(official_name(id_maps["bioguide"][cand_id]).split())
+                    if cand_id in id_maps["lis"]:
+                        tags.extend(official_name(id_maps["lis"][cand_id]).split())
 
                     details = {
-                        "form_id": base_info["form_id"],
-                        "client": base_info["client"],
-                        "senate_id": base_info["senate_id"],
-                        "house_id": base_info["house_id"],
-                        "lobbyist": base_info["lobbyist"],
-                        "contribution_type": contribution_info["type"],
-                        "amount": contribution_info["amount"],
-                        "contributor_name": contribution_info["contributor_name"],
-                        "recipient_name": contribution_info["recipient_name"],
-                    }
-
-                    final_info = {
-                        "date": date,
-                        "type": "ld203",
-                        "source": "https://disclosurespreview.house.gov/lc/lcxmlrelease/{}/{}/{}".format(
-                            info["reportYear"],
-                            info["reportType"],
-                            os.path.basename(filepath)
-                        ),
-                        "tags": ",".join(tags),
-                        "last_updated": datetime.datetime.now(),
-                        "details": json.dumps(details)
+                        "candidate_id": vote_info["id"],
+                        "category": session_info["category"],
+                        "vote_id": session_info["vote_id"],
+                        "vote_status": vote_status,
+                        "chamber": session_info["chamber"],
+                        "result": session_info["result"],
+                        "bill_id": session_info.get("bill_id", ""),
+                        "memo": session_info["memo"],
                     }
 
-                    db.session.add(create_result(final_info))
-
-                    n += 1
-                    if n % 1000 == 0:
-                        print(f"Parsed {n} records")
-
-            except Exception as e:
-                print(f"Failed to parse file {filepath}")
-                print(e)
-                #raise
-                continue
-
-        db.session.add(LocalFile(file_path=filepath,
-                                 file_hash=FILE_HASH_CACHE[filepath],
-                                 date_parsed=datetime.datetime.now()))
+                    rows.append(make_row(
+                        date,
+                        "congress_vote",
+                        info["source_url"],
+                        ",".join(tags),
+                        details
+                    ))
 
-    db.session.commit()
-    print(f"Uploaded {n} records")
+        except Exception as e:
+            print(f"Failed to parse {filepath}")
+            print(e)
+            raise
+    return rows, True
 
 
 def publish_congress_votes(db, source_dir, id_maps):
-    filepaths, invalid_filepaths = get_files(source_dir, ["data.json"])
-    assert filepaths, "No files found"
-
-    filepaths = get_new_files(filepaths)
-
-    print("The following files were invald:")
-    for filepath in invalid_filepaths:
-        print(f"    -{filepath}")
-
-    n = 0
-    for filepath in filepaths:
-        with open(filepath, "r") as f:
-            try:
-                info = json.load(f)
-
-                session_info = {
-                    "vote_id": info["vote_id"],
-                    "chamber": "house" if info["chamber"].lower() == "h" else "senate",
-                    "result": info["result"],
-                    "category": info["category"],
-                    "memo": info["question"]
-                }
-                if "bill" in info:
-                    session_info["bill_id"] = "{}{}-{}".format(info["bill"]["type"],
-                                                               info["bill"]["number"],
-                                                               info["bill"]["congress"])
-
-                for vote_status in info["votes"]:
-                    for vote_info in info["votes"][vote_status]:
-                        tags = list(session_info.values()) + list(vote_info.values())
-                        tags.extend([
-                            "vote",
-                            "congress",
-                            vote_status,
-                            info.get("subject", "")
-
-                        ])
-
-                        cand_id = vote_info["id"]
-                        if cand_id in id_maps["bioguide"]:
-                            tags.extend(id_maps["bioguide"][cand_id]["name"]["official_full"].split())
-                        if cand_id in id_maps["lis"]:
-                            tags.extend(id_maps["lis"][cand_id]["name"]["official_full"].split())
-
-                        details = {
-                            "candidate_id": vote_info["id"],
-                            "category": session_info["category"],
-                            "vote_id": session_info["vote_id"],
-                            "vote_status": vote_status,
-                            "chamber": session_info["chamber"],
-                            "result": session_info["result"],
-                            "bill_id": session_info.get("bill_id", ""),
-                            "memo": session_info["memo"],
-                        }
-
-                        final_info = {
-                            "date": parser.parse(info["date"]),
-                            "type": "congress_vote",
-                            "source": info["source_url"],
-                            "tags": ",".join(tags),
-                            "last_updated": datetime.datetime.now(),
-                            "details": json.dumps(details)
-                        }
-
-                        db.session.add(create_result(final_info))
-                        n += 1
-                        if n % 1000 == 0:
-                            print(f"Parsed {n} records")
-
-            except Exception as e:
-                print(f"Failed to parse {filepath}")
-                print(e)
-                raise
-                continue
-        db.session.add(LocalFile(file_path=filepath,
-                                 file_hash=FILE_HASH_CACHE[filepath],
-                                 date_parsed=datetime.datetime.now()))
-
-    db.session.commit()
-    print(f"Upladed {n} records")
+    filepaths = new_files(db, source_dir, ["data.json"])
+    publish_tasks(db, file_tasks(parse_congress_vote_file, filepaths), id_maps, FILE_HASH_CACHE)
+    publish_complete(db)
+
+
+# Schedule B (itpas2) has 22 fields per line
+SCHEDULE_B_FIELDS = 22
+SCHEDULE_B_TAGS = ["schedule_b", "schedule b", "fec", "contribution", "campaign"]
+SCHEDULE_B_SOURCE = "https://docquery.fec.gov/cgi-bin/fecimg/?"
+# Details key -> Schedule B field
+SCHEDULE_B_DETAILS = [
+    ("contributor_name", 7),
+    ("amount", 14),
+    ("candidate_id", 16),
+    ("record_id", 21),
+    ("committee_id", 0),
+    ("indicator", 1),
+    ("image_num", 4),
+    ("transaction_type", 5),
+    ("entity_type", 6),
+    ("file_num", 18),
+    ("transaction_id", 17),
+    ("other_id", 15),
+    ("memo", 20),
+]
+SCHEDULE_B_TEMPLATE = json_template([key for key, _ in SCHEDULE_B_DETAILS])
+
+
+def parse_schdb_date(date_info):
+    try:
+        return datetime.datetime.strptime(date_info, "%m%d%Y")
+    except ValueError:
+        return None
+
+
+def schdb_scan_date(date_info, scan_num):
+    """
+    Date of a Schedule B line without a valid transaction date, from its
+    image number. Raises ValueError when there is none.
+    """
+    try:
+        if len(scan_num) == 11:
+            assert scan_num[0:2].isdigit()
+            year = scan_num[0:2]
+            if 0 <= int(year) <= 60:
+                date_info = "010120" + year
+            else:
+                date_info = "010120" + year
+        elif len(scan_num) == 18:
+            assert scan_num[0:8].isdigit()
+            year = scan_num[0:4]
+            month = scan_num[4:6]
+            day = scan_num[6:8]
+            date_info = month + day + year
+    except Exception as e:
+        print(f"Unable to determine date for image {scan_num}")
+        print(e)
+        date_info = "01011900"
+    return datetime.datetime.strptime(date_info, "%m%d%Y")
+
+
+def name_tags(names, name_of):
+    """Tags suffix (",tok,tok") of the name of an id in names, "" if unknown."""
+    def tags(entity_id):
+        if entity_id not in names:
+            return ""
+        return "".join("," + token for token in name_of(names[entity_id]).split())
+    return tags
+
+
+def parse_schdb_chunk(filepath, id_maps, start, end, block=None):
+    """
+    Parse the Schedule B lines starting in [start, end) column by column
+    (see app.columnar). Chunks of compressed sources come with their bytes
+    in block.
+    """
+    if block is None:
+        text = read_block(filepath, start, end)
+    else:
+        text = block.decode("utf-8", errors="replace")
+    lines = block_lines(text)
+    n_lines = len(lines)
+    lines, bad = valid_lines(lines, SCHEDULE_B_FIELDS)
+    if bad:
+        print(f"Skipped {len(bad)} lines without {SCHEDULE_B_FIELDS} fields "
+              f"in {filepath} after byte {start}")
+    columns = split_columns(lines, SCHEDULE_B_FIELDS)
+    committee_ids = columns[0]
+    scan_nums = columns[4]
+    date_infos = columns[13]
+    other_ids = columns[15]
+    cand_ids = columns[16]
+
+    parsed = distinct(parse_schdb_date, date_infos)
+    dates = list(map(parsed.__getitem__, date_infos))
+    invalid = {date_info for date_info, date in parsed.items() if date is None}
+    failed = 0
+    for i in compress(range(len(dates)), map(invalid.__contains__, date_infos)):
+        try:
+            dates[i] = schdb_scan_date(date_infos[i], scan_nums[i])
+        except ValueError:
+            failed += 1
+    if failed:
+        print(f"Skipped {failed} lines without a date in {filepath} after byte {start}")
+
+    # Every non-empty field lowercased, then fixed tags, then the names of
+    # the candidate, other candidate and committee ids
+    candidate_tags = name_tags(id_maps["fec"], official_name)
+    committee_tags = name_tags(id_maps["committee"], str)
+    suffix = "," + ",".join(SCHEDULE_B_TAGS)
+    name_ids = list(zip(cand_ids, other_ids, committee_ids))
+    names = convert(lambda ids: suffix + candidate_tags(ids[0]) + candidate_tags(ids[1])
+                    + committee_tags(ids[2]), name_ids)
+    lowered = [list(map(str.lower, column)) for column in columns]
+    tags = list(map(str.__add__, joined_rows(lowered), names))
+
+    details = list(map(SCHEDULE_B_TEMPLATE.__mod__, zip(*[
+        encode_column(columns[i]) for _, i in SCHEDULE_B_DETAILS
+    ])))
+
+    # Same as attr_pairs(details): the indexed keys with a value. Rows with
+    # the same values share one (read only) tuple.
+    fields = dict(SCHEDULE_B_DETAILS)
+    attr_keys = [key for key in INDEXED_ATTRS if key in fields]
+    attr_values = list(zip(*[columns[fields[key]] for key in attr_keys]))
+    attrs = convert(lambda values: tuple(
+        (key, normalize_attr(value)) for key, value in zip(attr_keys, values) if value
+    ), attr_values) if attr_keys else repeat(())
+
+    # Lines left without a date are dropped
+    rows = list(map(ResultRow._make, compress(zip(
+        dates,
+        repeat("schedule_b"),
+        map(SCHEDULE_B_SOURCE.__add__, scan_nums),
+        tags,
+        details,
+        attrs,
+    ), dates)))
+    return rows, True, n_lines
 
 
 def publish_schdbs(db, source_dir, id_maps):
-    filepaths, invalid_filepaths = get_files(source_dir, [r"itpas2.txt"])
-    assert filepaths, "No files found"
+    filepaths = new_files(db, source_dir, [r"itpas2.txt"])
+    offsets = resume_offsets(db, filepaths, FILE_HASH_CACHE)
+    publish_tasks(db, chunk_tasks(parse_schdb_chunk, filepaths, offsets=offsets),
+                  id_maps, FILE_HASH_CACHE)
+    publish_complete(db)
 
-    filepaths = get_new_files(filepaths)
 
-    print("The following files were invald:")
-    for filepath in invalid_filepaths:
-        print(f"    -{filepath}")
-
-    n = 0
-    for filepath in filepaths:
-        with open(filepath, "r") as f:
-            for i, line in enumerate(f):
-                try:
-                    line_n = i + 1
-
-                    data = [tok.strip() for tok in line.split("|")]
-                    if len(data) != 22:
-                        raise ParseException("Failed to parse line {line_n} in {filepath}")
-
-                    tags = [d.lower() for d in data if d]
-                    tags.extend(["schedule_b", "schedule b", "fec", "contribution", "campaign"])
-                    other_id = data[15]
-                    cand_id = data[16]
-                    committee_id = data[0]
-                    if cand_id in id_maps["fec"]:
-                        tags.extend(id_maps["fec"][cand_id]["name"]["official_full"].split())
-                    if other_id in id_maps["fec"]:
-                        tags.extend(id_maps["fec"][other_id]["name"]["official_full"].split())
-                    if committee_id in id_maps["committee"]:
-                        tags.extend(id_maps["committee"][committee_id].split())
-
-                    # Figure out the date
-                    date_info = data[13]
-                    try:
-                        date = datetime.datetime.strptime(date_info, "%m%d%Y")
-                    except ValueError:
-                        try:
-                            scan_num = data[4]
-                            if len(scan_num) == 11:
-                                assert scan_num[0:2].isdigit()
-                                year = scan_num[0:2]
-                                if 0 <= int(year) <= 60:
-                                    date_info = "010120" + year
-                                else:
-                                    date_info = "010120" + year
-                            elif len(scan_num) == 18:
-                                assert scan_num[0:8].isdigit()
-                                year = scan_num[0:4]
-                                month = scan_num[4:6]
-                                day = scan_num[6:8]
-                                date_info = month + day + year
-                        except Exception as e:
-                            print(f"Unable to determine date for line {line_n}")
-                            print(e)
-                            date_info = "01011900"
-                        date = datetime.datetime.strptime(date_info, "%m%d%Y")
+def publish_congress_bills():
+    pass
 
-                    details = {
-                        "contributor_name": data[7],
-                        "amount": data[14],
-                        "candidate_id": data[16],
-                        "record_id": data[21],
-                        "committee_id": data[0],
-                        "indicator": data[1],
-                        "image_num": data[4],
-                        "transaction_type": data[5],
-                        "entity_type": data[6],
-                        "file_num": data[18],
-                        "transaction_id": data[17],
-                        "other_id": data[15],
-                        "memo": data[20]
-                    }
+def publish_congress_bill_actions():
+    pass
 
-                    final_info = {
-                        "date": date,
-                        "type": "schedule_b",
-                        "source": "https://docquery.fec.gov/cgi-bin/fecimg/?{}".format(data[4]),
-                        "tags": ",".join(tags),
-                        "last_updated": datetime.datetime.now(),
-                        "details": json.dumps(details)
-                    }
+COMMIT_N = 1000000
 
-                    db.session.add(create_result(final_info))
+# Results read per batch by tag-db
+TAG_BATCH_SIZE = 10000
 
-                    n += 1
-                    if n % 1000 == 0:
-                        print(f"Parsed {n} records")
+def create_indexes(db):
+    # create_all() only creates indexes along with new tables, so make sure
+    # databases created before an index was added get it as well. Tables
+    # added since (result_attrs) are created first, with their indexes.
+    for model in [Result, Tag, ResultAttr, LocalFile]:
+        model.__table__.create(db.engine, checkfirst=True)
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
 
-                except Exception as e:
-                    print(f"Failed to parse line {line_n} in {filepath}")
-                    print(e)
-                    continue
-        db.session.add(LocalFile(file_path=filepath,
-                                 file_hash=FILE_HASH_CACHE[filepath],
-                                 date_parsed=datetime.datetime.now()))
 
-        db.session.commit()
-        print(f"Upladed {n} records")
+def publish_attrs(db):
+    """
+    Backfill result_attrs for results published before it existed.
 
+    Every publisher writes at least one indexed key for its new results, so
+    the ones still missing attributes are all older than the oldest result
+    in result_attrs. The backfill works down from there, which keeps that
+    true if it is interrupted and lets searches tell when it is complete.
+    """
+    ResultAttr.__table__.create(db.engine, checkfirst=True)
+    create_indexes(db)
 
-def publish_congress_bills():
-    pass
+    writer = BulkWriter(db, current_app.config.get("BULK_BATCH_SIZE", 5000))
+    n = 0
+    last_id = None
+    while True:
+        # Another publish process may be backfilling too: hold off its
+        # batches and continue below whatever it has done.
+        writer.lock_results()
+        bounds = [db.session.query(func.min(ResultAttr.result_id)).scalar(), last_id]
+        bounds = [i for i in bounds if i is not None]
+        q = db.session.query(Result.id, Result.details)
+        if bounds:
+            q = q.filter(Result.id < min(bounds))
+        rows = q.order_by(Result.id.desc())\
+                .limit(COMMIT_N // 100)\
+                .all()
+        if not rows:
+            db.session.commit()
+            break
+        for result_id, details in rows:
+            attrs = attr_pairs(json.loads(details))
+            writer.add_attrs(result_id, attrs)
+            n += len(attrs)
+        last_id = rows[-1][0]
+        writer.commit()
+        print(f"Indexed attributes down to result {last_id}")
+
+    print(f"Added {n} attributes")
+    if n:
+        bump_generation(db)
+
+
+def update_keyword_stats(db):
+    """Recompute the document frequency of every keyword from the tag index."""
+    KeywordStat.__table__.create(db.engine, checkfirst=True)
+    db.session.query(KeywordStat).delete()
+    db.session.execute(
+        KeywordStat.__table__.insert().from_select(
+            ["keyword", "df"],
+            select(Tag.keyword, func.count(Tag.result_id.distinct()))
+            .group_by(Tag.keyword)
+        )
+    )
+    db.session.commit()
 
-def publish_congress_bill_actions():
-    pass
 
-COMMIT_N = 1000000
+def add_keyword_stats(db, counts):
+    """Add the document frequencies of newly tagged results to keyword_stats."""
+    table = KeywordStat.__table__
+    keywords = list(counts)
+    existing = set()
+    for i in range(0, len(keywords), IN_BATCH_SIZE):
+        existing.update(
+            keyword for keyword, in db.session.query(KeywordStat.keyword)
+                                      .filter(KeywordStat.keyword.in_(keywords[i:i + IN_BATCH_SIZE]))
+        )
 
-def publish_tags(db):
-    # Current count for commiting to the database
-    commit_i = 0
-
-    print(f"Tagging results ... ")
-    # TODO: Memory intensize
-    entries = Result.query.all()
-    n_total = len(entries)
-    for i, entry in enumerate(entries):
-        print(f"{i+1}/{n_total}")
-        pre_keywords = set(
-            kw.lower()
-            for kw in " ".join(entry.tags.split(",")).split()
+    updates = [{"kw": kw, "n": counts[kw]} for kw in existing]
+    if updates:
+        db.session.execute(
+            table.update()
+                 .where(table.c.keyword == bindparam("kw"))
+                 .values(df=table.c.df + bindparam("n")),
+            updates
         )
-        keywords = set()
-        for kw in pre_keywords:
-            if kw[0] in string.punctuation:
-                kw = kw[1::]
-            if not kw:
-                continue
-            if kw[-1] in string.punctuation:
-                kw = kw[:-1:]
-            if not kw:
-                continue
-            keywords.add(kw)
+    inserts = [{"keyword": kw, "df": counts[kw]} for kw in keywords if kw not in existing]
+    if inserts:
+        db.session.execute(table.insert(), inserts)
 
-        for kw in keywords:
-            new_tag_entry = Tag(
-                result_id=entry.id,
-                keyword=kw
-            )
 
-            db.session.add(new_tag_entry)
-            commit_i += 1
+def migrate_tags(db):
+    """
+    Recreate a tags table from before result_id was an integer column.
 
-        if commit_i >= COMMIT_N:
-            commit_i = 0
-            db.session.commit()
-            print("COMMIT!")
+    Its string ids neither sort nor compare like results.id, so the old
+    index is dropped along with keyword_stats and rebuilt from scratch.
+    """
+    db.session.commit()
+    inspector = inspect(db.engine)
+    if not inspector.has_table(Tag.__tablename__):
+        return
+    columns = {c["name"]: c["type"] for c in inspector.get_columns(Tag.__tablename__)}
+    if isinstance(columns.get("result_id"), Integer):
+        return
+    print("Dropping tag index with non-integer result ids, it will be rebuilt")
+    Tag.__table__.drop(db.engine)
+    Tag.__table__.create(db.engine)
+    db.session.query(KeywordStat).delete()
+    db.session.commit()
 
+
+def tagged_through(db):
+    """Highest result id in the tag index, 0 if it is empty."""
+    return db.session.query(func.max(cast(Tag.result_id, Integer))).scalar() or 0
+
+
+def publish_tags(db, rebuild=False):
+    """
+    Tag every result that is not in the tag index yet.
+
+    Results are tagged in id order, so everything up to the highest tagged
+    result id is done and re-runs only read newer results. Each batch is
+    committed with its keyword_stats increments, holding the writer's lock
+    on results from reading that id on so other publish processes can't
+    tag the same results.
+    """
+    KeywordStat.__table__.create(db.engine, checkfirst=True)
+    migrate_tags(db)
+    create_indexes(db)
+
+    writer = BulkWriter(db, current_app.config.get("BULK_BATCH_SIZE", 5000))
+    writer.lock_results()
+    if rebuild:
+        db.session.query(Tag).delete()
+        db.session.query(KeywordStat).delete()
+
+    last_id = tagged_through(db)
+    if last_id and db.session.query(KeywordStat.keyword).first() is None:
+        # Tag index from before keyword_stats existed
+        update_keyword_stats(db)
+        writer.lock_results()
+    elif not last_id:
+        db.session.query(KeywordStat).delete()
+
+    n_results = 0
+    n_tags = 0
+    print(f"Tagging results after {last_id} ...")
+    while True:
+        last_id = tagged_through(db)
+        rows = db.session.query(Result.id, Result.tags)\
+                         .filter(Result.id > last_id)\
+                         .order_by(Result.id)\
+                         .limit(TAG_BATCH_SIZE)\
+                         .all()
+        if not rows:
+            break
+
+        counts = Counter()
+        for result_id, tags in rows:
+            keywords = tokenize_tags(tags or "")
+            writer.add_tags(result_id, keywords)
+            counts.update(keywords)
+            n_tags += len(keywords)
+        add_keyword_stats(db, counts)
+        writer.commit()
+        writer.lock_results()
+
+        n_results += len(rows)
+        print(f"Tagged {n_results} results through {rows[-1][0]}")
     db.session.commit()
 
+    print(f"Added {n_tags} tags")
+    if n_tags:
+        bump_generation(db)
+
 
 PUBLISH_MAP = {
     "schedule_b": publish_schdbs,
@@ -676,12 +962,78 @@ PUBLISH_MAP = {
 }
 
 
-def publish(db, filename, id_map):
+def read_manifest(filename):
+    """(data type, source) for every entry of a publish manifest."""
+    entries = []
     with open(filename, "r") as f:
         for line in f:
             line = line.strip().split("#")[0]
             if not line:
                 continue
-            print (line)
             data_type, dir_path = line.split()
-            PUBLISH_MAP[data_type](db, dir_path, id_map)
\ No newline at end of file
+            entries.append((data_type, dir_path))
+    return entries
+
+
+def publish_entry(app, db, data_type, dir_path, id_map):
+    """
+    Publish one manifest entry in its own app context, and so its own
+    session. Returns (wall time, exception or None).
+    """
+    start = time.perf_counter()
+    with app.app_context():
+        try:
+            print(f"Publishing {data_type} {dir_path}")
+            PUBLISH_MAP[data_type](db, dir_path, id_map)
+        except Exception as e:
+            traceback.print_exc()
+            return time.perf_counter() - start, e
+        finally:
+            db.session.remove()
+    return time.perf_counter() - start, None
+
+
+def publish(db, filename, id_map, concurrency=None):
+    """
+    Publish every entry of a manifest, running up to concurrency entries at
+    once (0: all of them). Entries share one pool of parsing processes and
+    take turns writing (see app.ingest), so a run takes about as long as
+    its slowest entry. A failed entry doesn't stop the others.
+    """
+    entries = []
+    for entry in read_manifest(filename):
+        if entry[0] not in PUBLISH_MAP:
+            print(f"Invalid type: {entry[0]}")
+            return
+        if entry in entries:
+            print(f"Skipping duplicate entry: {' '.join(entry)}")
+            continue
+        entries.append(entry)
+    if not entries:
+        return
+
+    if concurrency is None:
+        concurrency = current_app.config.get("PUBLISH_CONCURRENCY") or 0
+    if concurrency <= 0 or concurrency > len(entries):
+        concurrency = len(entries)
+
+    app = current_app._get_current_object()
+    start = time.perf_counter()
+    # The pool is forked before any entry thread starts
+    with shared_pool(id_map):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(
+                lambda entry: publish_entry(app, db, entry[0], entry[1], id_map),
+                entries
+            ))
+    total = time.perf_counter() - start
+
+    print(f"Published {len(entries)} entries, {concurrency} at a time, in {total:.1f}s")
+    errors = []
+    for (data_type, dir_path), (elapsed, error) in zip(entries, results):
+        status = "ok" if error is None else f"failed: {error!r}"
+        print(f"    {elapsed:8.1f}s  {data_type:<20} {dir_path}  {status}")
+        if error is not None:
+            errors.append(error)
+    if errors:
+        raise errors[0]
@@ -0,0 +1,158 @@
+"""
+FEC bulk reference data: candidates (weballNN) and committees (cmNN) for
+every election cycle found in app/data.
+
+Each cycle may be given as the extracted .txt file or as the .zip archive
+downloaded from the FEC, which is read in place. Candidates are stored as
+FecCandidate objects with interned strings; a candidate whose details do
+not change between cycles is stored once and shared by every cycle.
+"""
+import io
+import os
+import re
+import sys
+import zipfile
+
+FEC_FILE_RE = re.compile(r"^(weball|cm)(\d{2})\.(txt|zip)$")
+
+# Two digit cycles from here on are in the 1900s (FEC bulk data starts in 1980)
+CENTURY_PIVOT = 80
+
+
+class FecCandidate(object):
+    __slots__ = ("fec_id", "first", "last", "official_full", "party", "state")
+
+    def __init__(self, fec_id, first, last, official_full, party, state):
+        self.fec_id = fec_id
+        self.first = first
+        self.last = last
+        self.official_full = official_full
+        self.party = party
+        self.state = state
+
+    def key(self):
+        return (self.fec_id, self.official_full, self.party, self.state)
+
+    def __repr__(self):
+        return f"FecCandidate({self.fec_id!r}, {self.official_full!r})"
+
+
+def official_name(profile):
+    """Full name of a legislator profile (dict) or FecCandidate."""
+    if isinstance(profile, FecCandidate):
+        return profile.official_full
+    return profile["name"]["official_full"]
+
+
+def cycle_year(digits):
+    n = int(digits)
+    return 1900 + n if n >= CENTURY_PIVOT else 2000 + n
+
+
+def find_fec_files(data_dir):
+    """
+    {(kind, cycle): path} for every FEC file in data_dir, where kind is
+    "weball" or "cm". The .txt file wins when both it and the .zip exist.
+    """
+    found = {}
+    for filename in sorted(os.listdir(data_dir)):
+        m = FEC_FILE_RE.match(filename)
+        if not m:
+            continue
+        kind, digits, ext = m.groups()
+        key = (kind, cycle_year(digits))
+        if key in found and ext == "zip":
+            continue
+        found[key] = os.path.join(data_dir, filename)
+    return found
+
+
+def read_lines(path):
+    """Lines of an FEC text file, or of the .txt member of an FEC .zip."""
+    if not path.endswith(".zip"):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            yield from f
+        return
+
+    with zipfile.ZipFile(path) as archive:
+        members = [n for n in archive.namelist() if n.endswith(".txt")]
+        if not members:
+            print(f"No .txt member in {path}")
+            return
+        with archive.open(members[0]) as raw:
+            yield from io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+
+def split_candidate_name(name):
+    try:
+        last, first = name.split(",", 1)
+    except ValueError:
+        try:
+            last, first = name.split(" ", 1)
+        except ValueError:
+            last = name
+            first = name
+    return first.strip().capitalize(), last.strip().capitalize()
+
+
+def parse_candidates(path, profiles):
+    """
+    {fec_id: FecCandidate} for one weball file. profiles maps
+    FecCandidate.key() to already loaded candidates so that unchanged ones
+    are shared between cycles.
+    """
+    intern = sys.intern
+    candidates = {}
+    for line in read_lines(path):
+        data = line.split("|")
+        if len(data) < 19:
+            continue
+        fec_id = intern(data[0])
+        first, last = split_candidate_name(data[1])
+        candidate = FecCandidate(
+            fec_id,
+            intern(first),
+            intern(last),
+            intern(f"{first} {last}"),
+            intern(data[4]),
+            intern(data[18]),
+        )
+        candidates[fec_id] = profiles.setdefault(candidate.key(), candidate)
+    return candidates
+
+
+def parse_committees(path):
+    """{committee_id: name} for one cm file."""
+    intern = sys.intern
+    committees = {}
+    for line in read_lines(path):
+        data = line.split("|")
+        if len(data) < 2:
+            continue
+        committees[intern(data[0])] = intern(data[1])
+    return committees
+
+
+def load_fec_cycles(data_dir):
+    """
+    ({cycle: {fec_id: FecCandidate}}, {cycle: {committee_id: name}}) for
+    every cycle in data_dir.
+    """
+    candidate_cycles = {}
+    committee_cycles = {}
+    profiles = {}
+    for (kind, cycle), path in sorted(find_fec_files(data_dir).items()):
+        if kind == "weball":
+            candidate_cycles[cycle] = parse_candidates(path, profiles)
+        else:
+            committee_cycles[cycle] = parse_committees(path)
+        print(f"Parsed FEC {kind} {cycle} from {os.path.basename(path)}")
+    return candidate_cycles, committee_cycles
+
+
+def latest(cycles):
+    """Flatten {cycle: {id: value}} keeping each id's most recent value."""
+    flat = {}
+    for cycle in sorted(cycles):
+        flat.update(cycles[cycle])
+    return flat
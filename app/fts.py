@@ -0,0 +1,127 @@
+"""
+Database-native full-text search over Result.tags and the values stored in
+Result.details.
+
+The index lives in a shadow table keyed by results.id:
+
+    sqlite:     FTS5 virtual table `results_fts(tags, details)`
+    postgresql: `results_fts(result_id, document tsvector)` with a GIN index
+
+Publishers call sync_fts() once they have committed, which indexes every
+result newer than the last one in the shadow table.
+"""
+from sqlalchemy import Float, Integer, bindparam, inspect, text
+
+FTS_TABLE = "results_fts"
+
+# Relative weight of tags vs details when ranking
+TAGS_WEIGHT = 2.0
+DETAILS_WEIGHT = 1.0
+
+
+def dialect(db):
+    return db.engine.dialect.name
+
+
+def create_fts_table(db):
+    if dialect(db) == "postgresql":
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {FTS_TABLE} ("
+            "result_id INTEGER PRIMARY KEY REFERENCES results (id), "
+            "document TSVECTOR)"
+        ))
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{FTS_TABLE}_document "
+            f"ON {FTS_TABLE} USING GIN (document)"
+        ))
+    else:
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(tags, details)"
+        ))
+    db.session.commit()
+
+
+def drop_fts_table(db):
+    db.session.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    db.session.commit()
+
+
+def sync_fts(db):
+    """Index every result that is not in the shadow table yet."""
+    create_fts_table(db)
+    if dialect(db) == "postgresql":
+        stmt = text(
+            f"INSERT INTO {FTS_TABLE} (result_id, document) "
+            "SELECT r.id, "
+            "setweight(to_tsvector('simple', coalesce(r.tags, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce("
+            "(SELECT string_agg(d.value, ' ') FROM json_each_text(r.details::json) d), "
+            "'')), 'B') "
+            "FROM results r "
+            f"WHERE r.id > (SELECT coalesce(max(result_id), 0) FROM {FTS_TABLE})"
+        )
+    else:
+        stmt = text(
+            f"INSERT INTO {FTS_TABLE} (rowid, tags, details) "
+            "SELECT r.id, replace(r.tags, ',', ' '), "
+            "(SELECT group_concat(d.value, ' ') FROM json_each(r.details) d) "
+            "FROM results r "
+            f"WHERE r.id > (SELECT coalesce(max(rowid), 0) FROM {FTS_TABLE})"
+        )
+    n = db.session.execute(stmt).rowcount
+    db.session.commit()
+    print(f"Indexed {n} results for full-text search")
+
+
+def delete_fts(db, first_id, last_id):
+    """Remove the results with ids in [first_id, last_id] from the index."""
+    # Through the session, which may already hold the write lock
+    if not inspect(db.session.connection()).has_table(FTS_TABLE):
+        return
+    column = "result_id" if dialect(db) == "postgresql" else "rowid"
+    db.session.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE {column} BETWEEN :first AND :last"),
+        {"first": first_id, "last": last_id}
+    )
+
+
+def match_expression(keywords):
+    """FTS5 query requiring every keyword (multi-word keywords as phrases)."""
+    phrases = [
+        '"{}"'.format(kw.replace('"', '""'))
+        for kw in keywords
+        if any(c.isalnum() for c in kw)
+    ]
+    return " AND ".join(phrases)
+
+
+def fts_matches(db, keywords, name="fts"):
+    """
+    Select (result_id, rank) for results matching every keyword.
+
+    Lower ranks are better on every backend, so callers can always sort
+    ascending. `name` aliases the subquery and prefixes its parameters so
+    several matches can be used in one statement.
+    """
+    keywords = [kw for kw in keywords if any(c.isalnum() for c in kw)]
+    if not keywords:
+        return None
+
+    if dialect(db) == "postgresql":
+        params = {f"{name}_kw{i}": kw for i, kw in enumerate(keywords)}
+        tsquery = " && ".join(
+            f"phraseto_tsquery('simple', :{param})" for param in params
+        )
+        stmt = text(
+            f"SELECT result_id, -ts_rank(document, {tsquery}) AS rank "
+            f"FROM {FTS_TABLE} WHERE document @@ ({tsquery})"
+        ).bindparams(**params)
+    else:
+        stmt = text(
+            f"SELECT rowid AS result_id, "
+            f"bm25({FTS_TABLE}, {TAGS_WEIGHT}, {DETAILS_WEIGHT}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :{name}_match"
+        ).bindparams(bindparam(f"{name}_match", match_expression(keywords)))
+
+    return stmt.columns(result_id=Integer, rank=Float).subquery(name)
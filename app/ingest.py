@@ -0,0 +1,366 @@
+"""
+Publishing pipeline.
+
+Parsing source files is CPU bound (XML, date parsing, tag building), so it
+fans out to a pool of worker processes. Each task parses one file, or one
+chunk of a large line-oriented file, into plain ResultRow tuples; the
+calling process is the only one that touches the database and writes the
+rows in task order.
+
+Rows go through a BulkWriter and are committed at file boundaries only,
+together with the file's LocalFile entry, so an interrupted publish never
+leaves a file half written and resumes with the first file that was not
+committed.
+
+Large files split into chunks are checkpointed instead: every chunk is
+committed together with an IngestProgress row holding the byte offset and
+line number reached, and an interrupted publish resumes from there. The ids
+each chunk wrote are kept in IngestChunk to undo the partial publish if the
+file changes before it is resumed.
+
+Several publishes can run side by side in threads (the publish command's
+manifest entries). They share one pool of parsing processes, and buffer
+what they parse until their next commit so they only hold WRITE_LOCK, which
+serializes every write, while writing. Their commits interleave, so a file
+written over several commits does not get one contiguous range of result
+ids; only what one commit wrote for it is contiguous.
+"""
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from itertools import chain, islice
+
+from flask import current_app
+from sqlalchemy import bindparam, func
+
+from app.bulk import BulkWriter
+from app.fts import delete_fts
+from app.models.activity import (
+    IngestChunk,
+    IngestProgress,
+    KeywordStat,
+    Result,
+    ResultAttr,
+    Tag,
+    attr_pairs,
+)
+from app.sources import compressed, open_source
+
+ResultRow = namedtuple("ResultRow", ["date", "type", "source", "tags", "details", "attrs"])
+
+# A unit of parsing work: parse(filepath, id_maps, *args) -> (rows, ok),
+# or (rows, ok, lines read) for chunks. LocalFile is recorded once the task
+# marked last for a file is written and every task of that file was ok.
+# Checkpointed tasks are committed one by one with their progress.
+Task = namedtuple("Task", ["parse", "filepath", "args", "last", "checkpoint"])
+
+# Id maps the parsers look names up in, copied into every worker
+WORKER_MAPS = ["bioguide", "lis", "fec", "committee"]
+
+# Tasks queued per worker ahead of the writer. Parsed chunks are held in
+# memory until written, so this bounds memory to about
+# workers * QUEUE_DEPTH * CHUNK_BYTES worth of rows.
+QUEUE_DEPTH = 2
+
+# Pending rows after which the writer commits at the next file boundary
+COMMIT_ROWS = 10000
+
+# Counts parsers keep while parsing a task (e.g. dates that needed a slow
+# path). Sent back with the task's rows, so worker counts reach the writer,
+# and totalled by publish_tasks.
+PARSE_STATS = Counter()
+
+# Held while writing to the database. Result ids are allocated by the
+# writer from max(results.id), and SQLite allows one writer at a time.
+WRITE_LOCK = threading.RLock()
+
+# Lines of a large file parsed (and committed) per task
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def make_row(date, type, source, tags, details):
+    return ResultRow(date, type, source, tags, json.dumps(details), attr_pairs(details))
+
+
+def file_tasks(parse, filepaths):
+    return [Task(parse, filepath, (), True, False) for filepath in filepaths]
+
+
+def chunk_tasks(parse, filepaths, chunk_bytes=None, offsets=None):
+    """
+    One checkpointed task per chunk_bytes of each file, as (start, end)
+    byte offsets, starting from offsets[filepath] when resuming. Parsers
+    own the lines that start within [start, end).
+
+    Compressed sources can't be read from an offset, so they are streamed
+    here instead and their tasks carry the chunk's bytes as a third arg.
+    Tasks are generated as the pipeline consumes them.
+    """
+    chunk_bytes = chunk_bytes or CHUNK_BYTES
+    offsets = offsets or {}
+    for filepath in filepaths:
+        start = offsets.get(filepath, 0)
+        if compressed(filepath):
+            yield from stream_chunk_tasks(parse, filepath, chunk_bytes, start)
+            continue
+        size = os.path.getsize(filepath)
+        while True:
+            end = min(start + chunk_bytes, size)
+            yield Task(parse, filepath, (start, end), end >= size, True)
+            if end >= size:
+                break
+            start = end
+
+
+def read_blocks(f, chunk_bytes):
+    """Blocks of about chunk_bytes of whole lines from the binary file f."""
+    while True:
+        block = f.read(chunk_bytes)
+        if not block:
+            return
+        if not block.endswith(b"\n"):
+            block += f.readline()
+        yield block
+
+
+def stream_chunk_tasks(parse, filepath, chunk_bytes, start=0):
+    with open_source(filepath) as f:
+        # Skip what an interrupted publish already committed
+        skipped = 0
+        while skipped < start:
+            data = f.read(min(start - skipped, chunk_bytes))
+            if not data:
+                break
+            skipped += len(data)
+
+        blocks = read_blocks(f, chunk_bytes)
+        block = next(blocks, b"")
+        while True:
+            following = next(blocks, None)
+            end = start + len(block)
+            yield Task(parse, filepath, (start, end, block), following is None, True)
+            if following is None:
+                break
+            start, block = end, following
+
+
+_worker_id_maps = None
+
+# (pool, processes) shared by every publish_tasks call while set
+_shared_pool = None
+
+
+def init_worker(id_maps):
+    global _worker_id_maps
+    _worker_id_maps = id_maps
+
+
+def run_task(task):
+    PARSE_STATS.clear()
+    rows, ok, *lines = task.parse(task.filepath, _worker_id_maps, *task.args)
+    return task, rows, ok, lines[0] if lines else 0, dict(PARSE_STATS)
+
+
+def publish_workers():
+    n = current_app.config.get("PUBLISH_WORKERS") or 0
+    return n if n > 0 else (os.cpu_count() or 1)
+
+
+def worker_maps(id_maps):
+    return {name: dict(id_maps[name]) for name in WORKER_MAPS}
+
+
+@contextmanager
+def shared_pool(id_maps, jobs=None):
+    """
+    Parse the tasks of every publish_tasks call made inside the block with
+    one pool of jobs processes, so concurrent publishes share them. Start
+    it before any other thread: the processes are forked.
+    """
+    global _shared_pool
+    jobs = jobs or publish_workers()
+    with multiprocessing.Pool(jobs, initializer=init_worker,
+                              initargs=(worker_maps(id_maps),)) as pool:
+        _shared_pool = (pool, jobs)
+        try:
+            yield pool
+        finally:
+            _shared_pool = None
+
+
+def run_pooled(pool, tasks, jobs):
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(run_task, (task,)))
+        if len(pending) >= jobs * QUEUE_DEPTH:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def parse_tasks(tasks, id_maps, jobs):
+    """(task, rows, ok, lines, stats) for every task, in order."""
+    if _shared_pool is not None:
+        pool, jobs = _shared_pool
+        yield from run_pooled(pool, tasks, jobs)
+        return
+
+    tasks = iter(tasks)
+    head = list(islice(tasks, 2))
+    tasks = chain(head, tasks)
+    if jobs <= 1 or len(head) <= 1:
+        init_worker(worker_maps(id_maps))
+        for task in tasks:
+            yield run_task(task)
+        return
+
+    # Workers only parse; they never touch the database connection the
+    # writer may have open when they are forked.
+    with multiprocessing.Pool(jobs, initializer=init_worker,
+                              initargs=(worker_maps(id_maps),)) as pool:
+        yield from run_pooled(pool, tasks, jobs)
+
+
+def delete_results(db, first_id, last_id):
+    """
+    Delete the results with ids in [first_id, last_id] and their index rows.
+
+    The ids are handed out again by the next publish, so the full-text and
+    tag indexes must not keep anything for them: both only index results
+    newer than the last one they hold.
+    """
+    counts = db.session.query(Tag.keyword, func.count(Tag.result_id.distinct()))\
+                       .filter(Tag.result_id.between(first_id, last_id))\
+                       .group_by(Tag.keyword)\
+                       .all()
+    if counts:
+        stats = KeywordStat.__table__
+        db.session.execute(
+            stats.update()
+                 .where(stats.c.keyword == bindparam("kw"))
+                 .values(df=stats.c.df - bindparam("n")),
+            [{"kw": keyword, "n": n} for keyword, n in counts]
+        )
+        db.session.query(KeywordStat)\
+                  .filter(KeywordStat.df <= 0)\
+                  .delete(synchronize_session=False)
+    delete_fts(db, first_id, last_id)
+    for model in [ResultAttr, Tag]:
+        db.session.query(model)\
+                  .filter(model.result_id.between(first_id, last_id))\
+                  .delete(synchronize_session=False)
+    db.session.query(Result)\
+              .filter(Result.id.between(first_id, last_id))\
+              .delete(synchronize_session=False)
+
+
+def resume_offsets(db, filepaths, file_hashes):
+    """
+    {filepath: byte offset} to resume interrupted chunked publishes from.
+
+    Progress recorded for other contents of a file is dropped along with
+    the results its committed chunks wrote, and the file starts over.
+    """
+    offsets = {}
+    with WRITE_LOCK:
+        IngestProgress.__table__.create(db.engine, checkfirst=True)
+        IngestChunk.__table__.create(db.engine, checkfirst=True)
+        for progress in IngestProgress.query.filter(IngestProgress.file_path.in_(filepaths)):
+            if progress.file_hash == file_hashes.get(progress.file_path):
+                offsets[progress.file_path] = progress.byte_offset
+                print(f"Resuming {progress.file_path} at line {progress.line_number + 1}")
+                continue
+            print(f"{progress.file_path} changed since it was partially published, starting over")
+            chunks = IngestChunk.query.filter_by(file_path=progress.file_path)
+            for chunk in chunks:
+                delete_results(db, chunk.first_result_id, chunk.last_result_id)
+            chunks.delete(synchronize_session=False)
+            db.session.delete(progress)
+        db.session.commit()
+    return offsets
+
+
+def record_progress(db, task, file_hash, lines, first_id, last_id, now):
+    progress = IngestProgress.query.get(task.filepath)
+    if progress is None:
+        progress = IngestProgress(file_path=task.filepath, file_hash=file_hash,
+                                  line_number=0)
+        db.session.add(progress)
+    progress.byte_offset = task.args[1]
+    progress.line_number += lines
+    progress.last_updated = now
+    if first_id is not None:
+        db.session.add(IngestChunk(file_path=task.filepath, first_result_id=first_id,
+                                   last_result_id=last_id))
+
+
+def write_tasks(db, writer, parsed, file_hashes, failed):
+    """
+    Write parsed (task, rows, ok, lines) results and commit, holding
+    WRITE_LOCK. Returns the number of rows written.
+    """
+    n = 0
+    with WRITE_LOCK:
+        for task, rows, ok, lines in parsed:
+            now = datetime.datetime.now()
+            first_id = last_id = None
+            for row in rows:
+                last_id = writer.add_result(row.date, row.type, row.source, row.tags,
+                                            row.details, row.attrs, last_updated=now)
+                if first_id is None:
+                    first_id = last_id
+            n += len(rows)
+
+            if not ok:
+                failed.add(task.filepath)
+            if task.checkpoint and not task.last:
+                # Other publishes write between chunks: record this one's ids
+                record_progress(db, task, file_hashes[task.filepath], lines,
+                                first_id, last_id, now)
+                continue
+            if task.checkpoint:
+                IngestProgress.query.filter_by(file_path=task.filepath).delete()
+                IngestChunk.query.filter_by(file_path=task.filepath).delete()
+            if task.last and task.filepath not in failed:
+                writer.add_file(task.filepath, file_hashes[task.filepath], now)
+        writer.commit()
+    return n
+
+
+def publish_tasks(db, tasks, id_maps, file_hashes, jobs=None):
+    """Parse tasks in parallel and write their rows. Returns the row count."""
+    jobs = _shared_pool[1] if _shared_pool is not None else jobs or publish_workers()
+    print(f"Parsing with {jobs} workers")
+
+    writer = BulkWriter(db, current_app.config.get("BULK_BATCH_SIZE", 5000))
+    n = 0
+    parsed = []
+    pending = 0
+    failed = set()
+    stats = Counter()
+    n_tasks = 0
+    for task, rows, ok, lines, task_stats in parse_tasks(tasks, id_maps, jobs):
+        stats.update(task_stats)
+        n_tasks += 1
+        parsed.append((task, rows, ok, lines))
+        pending += len(rows)
+        # Commit every checkpointed chunk, and whole files only
+        if task.checkpoint or (task.last and pending >= COMMIT_ROWS):
+            n += write_tasks(db, writer, parsed, file_hashes, failed)
+            print(f"Wrote {n} records")
+            parsed = []
+            pending = 0
+
+    n += write_tasks(db, writer, parsed, file_hashes, failed)
+    if failed:
+        print("Failed to parse the following:")
+        for filepath in sorted(failed):
+            print(filepath)
+    for name, count in sorted(stats.items()):
+        print(f"{name}: {count}")
+    print(f"Uploaded {n} records from {n_tasks} tasks")
+    return n
@@ -0,0 +1,80 @@
+"""
+Streaming extractor for LDA filings (LOBBYINGDISCLOSURE1,
+LOBBYINGDISCLOSURE2 and CONTRIBUTIONDISCLOSURE XML).
+
+The publishers only need the leaf values of a filing and of a few
+repeated records inside it (lobbyists, ALIs, contributions), so instead of
+building a document tree the file is read with iterparse and every record
+is turned into a dict and cleared as soon as it ends.
+
+A filing comes back as a dict of its leaf values plus, for each record
+type found, a list of records under the record's tag. Records are dicts of
+the same shape and nest: a LD-2's "ali_info" records each hold their own
+"lobbyist" list. Wrapper elements (<lobbyists>, <alis>, ...) are skipped.
+As with xmltodict, a leaf's text is stripped and empty leaves are None; a
+leaf repeated within one record (e.g. several <description>s) becomes a
+list of its values.
+"""
+import xml.etree.ElementTree as ET
+
+# Record tags and the record tags that nest inside them
+RECORD_TAGS = {
+    "lobbyist": (),
+    "ali_info": ("lobbyist",),
+    "contribution": (),
+}
+
+
+def leaf_value(elem):
+    text = (elem.text or "").strip()
+    return text or None
+
+
+def set_leaf(record, tag, value):
+    if tag not in record:
+        record[tag] = value
+    elif isinstance(record[tag], list):
+        record[tag].append(value)
+    else:
+        record[tag] = [record[tag], value]
+
+
+def leaf_values(elem):
+    """Leaf values below elem, skipping records (already cleared)."""
+    values = {}
+    for child in elem.iter():
+        if child is not elem and not len(child) and child.tag not in RECORD_TAGS:
+            set_leaf(values, child.tag, leaf_value(child))
+    return values
+
+
+def read_filing(source, root_tag):
+    """The leaf values and records of the filing in source (a path or file)."""
+    # Records waiting for the record that contains them: nested records
+    # end before their parent, so a record takes every pending record of
+    # the types that nest inside it.
+    pending = {}
+    elem = None
+    for _, elem in ET.iterparse(source):
+        nested = RECORD_TAGS.get(elem.tag)
+        if nested is not None:
+            record = leaf_values(elem)
+            for tag in nested:
+                if tag in pending:
+                    record[tag] = pending.pop(tag)
+            pending.setdefault(elem.tag, []).append(record)
+            # Only the empty element stays attached to its parent
+            elem.clear()
+
+    if elem is None or elem.tag != root_tag:
+        raise ValueError(f"Expected <{root_tag}>, found <{getattr(elem, 'tag', None)}>")
+    filing = leaf_values(elem)
+    filing.update(pending)
+    return filing
+
+
+def text(value, sep="; "):
+    """A leaf value as a single string (repeated leaves are joined)."""
+    if isinstance(value, list):
+        return sep.join(v for v in value if v is not None)
+    return value
@@ -3,10 +3,45 @@ from app import db
 class LocalFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     file_hash = db.Column(db.Integer)
-    file_path = db.Column(db.String)
+    file_path = db.Column(db.String, index=True)
     date_parsed = db.Column(db.DateTime)
 
 
+class FileManifest(db.Model):
+    """Size, mtime and hash of every source file when it was last hashed."""
+    __tablename__ = "file_manifest"
+
+    file_path = db.Column(db.String, primary_key=True)
+    file_size = db.Column(db.BigInteger)
+    file_mtime_ns = db.Column(db.BigInteger)
+    file_hash = db.Column(db.String)
+
+
+class IngestProgress(db.Model):
+    """How far an interrupted chunked publish of a large file got."""
+    __tablename__ = "ingest_progress"
+
+    file_path = db.Column(db.String, primary_key=True)
+    file_hash = db.Column(db.String)
+    byte_offset = db.Column(db.BigInteger)
+    line_number = db.Column(db.BigInteger)
+    last_updated = db.Column(db.DateTime)
+
+
+class IngestChunk(db.Model):
+    """
+    Result ids one committed chunk of an interrupted publish wrote, so a
+    changed file's partial publish can be undone. Other publishes commit
+    between chunks, so a file's results are only contiguous per chunk.
+    """
+    __tablename__ = "ingest_chunks"
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.String, index=True)
+    first_result_id = db.Column(db.Integer)
+    last_result_id = db.Column(db.Integer)
+
+
 class Result(db.Model):
     __tablename__ = "results"
     id = db.Column(db.Integer, primary_key=True)
@@ -18,15 +53,87 @@ class Result(db.Model):
     details = db.Column(db.String)
 
     all_tags = db.relationship("Tag", lazy=True, backref=db.backref("result", lazy=False))
+    attrs = db.relationship("ResultAttr", lazy=True)
+
+    # Serves the (date, id) ordering and keyset pagination of search results
+    __table_args__ = (
+        db.Index("ix_results_date_id", "date", "id"),
+    )
 
 
 class Tag(db.Model):
     __tablename__ = 'tags'
 
     id = db.Column(db.Integer, primary_key=True)
-    result_id = db.Column(db.String, db.ForeignKey(Result.id))
+    result_id = db.Column(db.Integer, db.ForeignKey(Result.id), index=True)
     keyword = db.Column(db.String)
 
+    # Inverted index: keyword -> posting list of result ids
+    __table_args__ = (
+        db.Index("ix_tags_keyword_result_id", "keyword", "result_id"),
+    )
+
+
+# Details keys copied into result_attrs for exact "key": "value" lookups
+INDEXED_ATTRS = [
+    "client",
+    "registrant",
+    "candidate_id",
+    "committee_id",
+    "bill_id",
+    "vote_id",
+    "form_id",
+]
+
+
+def normalize_attr(value):
+    """Attr values are matched case and whitespace insensitively."""
+    return " ".join(str(value).split()).lower()
+
+
+class ResultAttr(db.Model):
+    """Commonly filtered details values, one row per (result, key)."""
+    __tablename__ = 'result_attrs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    result_id = db.Column(db.Integer, db.ForeignKey(Result.id), index=True)
+    key = db.Column(db.String)
+    value = db.Column(db.String)
+
+    __table_args__ = (
+        db.Index("ix_result_attrs_key_value", "key", "value"),
+    )
+
+    @classmethod
+    def from_details(cls, details):
+        return [cls(key=key, value=value) for key, value in attr_pairs(details)]
+
+
+def attr_pairs(details):
+    """(key, normalized value) for every indexed key set in details."""
+    return [
+        (key, normalize_attr(details[key]))
+        for key in INDEXED_ATTRS
+        if details.get(key)
+    ]
+
+
+class KeywordStat(db.Model):
+    """Document frequency of every keyword in the tag index."""
+    __tablename__ = 'keyword_stats'
+
+    keyword = db.Column(db.String, primary_key=True)
+    df = db.Column(db.Integer)
+
+
+class Generation(db.Model):
+    """Counter bumped by every publish, used to invalidate cached searches."""
+    __tablename__ = 'generation'
+
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, default=0)
+    last_updated = db.Column(db.DateTime)
+
 
 """
 class CongressVote(ActivityMixin, db.Model):
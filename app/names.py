@@ -0,0 +1,48 @@
+"""
+One index from every id a result can carry (bioguide, lis, FEC candidate,
+govtrack, FEC committee) to the display data the templates need, so each
+filter is a single dict lookup instead of a probe through every id map.
+"""
+import sys
+
+from app.fec import official_name
+
+GOVTRACK_MEMBER_URL = "https://www.govtrack.us/congress/members/{}"
+
+
+class NameEntry(object):
+    __slots__ = ("name", "govtrack_url")
+
+    def __init__(self, name, govtrack_url=None):
+        self.name = name
+        self.govtrack_url = govtrack_url
+
+    def __repr__(self):
+        return f"NameEntry({self.name!r}, {self.govtrack_url!r})"
+
+
+def build_name_index(id_maps):
+    """
+    {id: NameEntry} over every id map. When an id appears in several maps
+    the first of bioguide, lis, fec, govtrack, committee wins, the order
+    smart_find used to probe them in.
+    """
+    index = {}
+    # One entry per profile, shared by all of its ids
+    entries = {}
+
+    def entry_for(profile):
+        key = id(profile)
+        if key not in entries:
+            govtrack_url = None
+            if isinstance(profile, dict) and "govtrack" in profile["id"]:
+                govtrack_url = GOVTRACK_MEMBER_URL.format(profile["id"]["govtrack"])
+            entries[key] = NameEntry(sys.intern(official_name(profile)), govtrack_url)
+        return entries[key]
+
+    for committee_id, name in id_maps["committee"].items():
+        index[committee_id] = NameEntry(name)
+    for name in ["govtrack", "fec", "lis", "bioguide"]:
+        for profile_id, profile in id_maps[name].items():
+            index[profile_id] = entry_for(profile)
+    return index
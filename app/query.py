@@ -0,0 +1,244 @@
+"""
+Search query language for gquery.
+
+    widget tariff              both words (AND is implicit)
+    "jane doe"                 phrase
+    "client": "Widget Corp"    exact details attribute
+    pelosi OR schumer          either word
+    NOT ld2, -ld2              exclude
+    (a OR b) c                 grouping
+    type:ld203                 result type
+    after:2020-01-01           on or after a date
+    before:2020-06-30          on or before a date
+    date:2020-01..2020-06      date range (YYYY, YYYY-MM, YYYY-MM-DD or
+                               MM/DD/YYYY; either side may be left open)
+
+Operators must be upper case so that "or", "and" and "not" can still be
+searched for. The parser is lenient: stray parentheses and dangling
+operators are ignored instead of raising, and so are parentheses nested
+deeper than MAX_DEPTH.
+"""
+import calendar
+import datetime
+import re
+from collections import namedtuple
+
+Term = namedtuple("Term", ["text"])
+Attr = namedtuple("Attr", ["key", "value"])
+TypeFilter = namedtuple("TypeFilter", ["type"])
+DateRange = namedtuple("DateRange", ["start", "end"])
+And = namedtuple("And", ["children"])
+Or = namedtuple("Or", ["children"])
+Not = namedtuple("Not", ["child"])
+
+TOKEN_RE = re.compile(r"""
+    (?P<attr>"(?P<key>[^"]+)"\s*:\s*"(?P<value>[^"]*)")
+  | (?P<phrase>"(?P<phrase_text>[^"]*)"?)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<field>(?P<field_name>type|after|before|date):(?P<field_value>[^\s()"]+))
+  | (?P<word>[^\s()"]+)
+""", re.VERBOSE | re.IGNORECASE)
+
+OPERATORS = {"AND", "OR", "NOT"}
+
+# Parenthesized groups nested deeper than this are flattened into their parent
+MAX_DEPTH = 32
+
+DATE_FORMATS = [
+    ("%Y-%m-%d", "day"),
+    ("%m/%d/%Y", "day"),
+    ("%Y-%m", "month"),
+    ("%Y", "year"),
+]
+
+
+def lex(text):
+    tokens = []
+    for m in TOKEN_RE.finditer(text):
+        if m.group("attr"):
+            tokens.append(("attr", Attr(m.group("key").strip(), m.group("value").strip())))
+        elif m.group("phrase") is not None:
+            phrase = " ".join(m.group("phrase_text").split())
+            if phrase:
+                tokens.append(("term", Term(phrase.lower())))
+        elif m.group("lparen"):
+            tokens.append(("(", None))
+        elif m.group("rparen"):
+            tokens.append((")", None))
+        elif m.group("field"):
+            node = parse_field(m.group("field_name").lower(), m.group("field_value"))
+            if node is not None:
+                tokens.append(("term", node))
+            else:
+                tokens.append(("term", Term(m.group("field").lower())))
+        else:
+            word = m.group("word")
+            if word in OPERATORS:
+                tokens.append((word, None))
+            elif word.startswith("-") and len(word) > 1:
+                tokens.append(("NOT", None))
+                tokens.append(("term", Term(word[1:].lower())))
+            else:
+                tokens.append(("term", Term(word.lower())))
+    return tokens
+
+
+def parse_date(text, end=False):
+    """Parse a date operand; the end of a range extends to the end of its period."""
+    for fmt, period in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if not end:
+            return date
+        if period == "year":
+            return date.replace(month=12, day=31)
+        if period == "month":
+            last_day = calendar.monthrange(date.year, date.month)[1]
+            return date.replace(day=last_day)
+        return date
+    return None
+
+
+def parse_field(name, value):
+    if name == "type":
+        return TypeFilter(value.lower())
+    if name == "after":
+        start = parse_date(value)
+        return DateRange(start, None) if start else None
+    if name == "before":
+        end = parse_date(value, end=True)
+        return DateRange(None, end) if end else None
+    if name == "date":
+        if ".." in value:
+            start_text, end_text = value.split("..", 1)
+        else:
+            start_text, end_text = value, value
+        start = parse_date(start_text) if start_text else None
+        end = parse_date(end_text, end=True) if end_text else None
+        if (start_text and start is None) or (end_text and end is None):
+            return None
+        return DateRange(start, end)
+    return None
+
+
+class Parser(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.i = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.i][0] if self.i < len(self.tokens) else None
+
+    def next(self):
+        token = self.tokens[self.i]
+        self.i += 1
+        return token
+
+    def parse(self):
+        children = []
+        while self.peek() is not None:
+            node = self.parse_or()
+            if node is not None:
+                children.append(node)
+            elif self.peek() is not None:
+                # Stray closing parenthesis or operator
+                self.next()
+        return make_and(children)
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == "OR":
+            self.next()
+            children.append(self.parse_and())
+        children = [c for c in children if c is not None]
+        if len(children) > 1:
+            return Or(tuple(children))
+        return children[0] if children else None
+
+    def parse_and(self):
+        children = []
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.next()
+                continue
+            node = self.parse_unary()
+            if node is not None:
+                children.append(node)
+        return make_and(children)
+
+    def parse_unary(self):
+        # NOT NOT x is x, so a chain of NOTs only needs its parity
+        negate = False
+        while self.peek() == "NOT":
+            self.next()
+            negate = not negate
+        node = self.parse_primary()
+        if negate and node is not None:
+            return Not(node)
+        return node
+
+    def parse_primary(self):
+        kind = self.peek()
+        if kind == "(":
+            self.next()
+            if self.depth >= MAX_DEPTH:
+                # The matching ")" is skipped as a stray one
+                return None
+            self.depth += 1
+            node = self.parse_or()
+            self.depth -= 1
+            if self.peek() == ")":
+                self.next()
+            return node
+        if kind == "term" or kind == "attr":
+            return self.next()[1]
+        self.next()
+        return None
+
+
+def make_and(children):
+    flat = []
+    for child in children:
+        if isinstance(child, And):
+            flat.extend(child.children)
+        elif child is not None:
+            flat.append(child)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else And(tuple(flat))
+
+
+def parse_query(text):
+    """Parse gquery text into an AST (None for an empty query)."""
+    return Parser(lex(text or "")).parse()
+
+
+def conjuncts(node):
+    """The nodes that must all match for node to match."""
+    if node is None:
+        return []
+    return list(node.children) if isinstance(node, And) else [node]
+
+
+def canonical(node):
+    """Stable text form of a query; equivalent queries share it."""
+    if node is None:
+        return ""
+    if isinstance(node, Term):
+        return '"{}"'.format(node.text)
+    if isinstance(node, Attr):
+        return '"{}": "{}"'.format(node.key, node.value)
+    if isinstance(node, TypeFilter):
+        return "type:{}".format(node.type)
+    if isinstance(node, DateRange):
+        return "date:{}..{}".format(
+            node.start.strftime("%Y-%m-%d") if node.start else "",
+            node.end.strftime("%Y-%m-%d") if node.end else "")
+    if isinstance(node, Not):
+        return "NOT ({})".format(canonical(node.child))
+    op = " AND " if isinstance(node, And) else " OR "
+    return "(" + op.join(sorted(canonical(c) for c in node.children)) + ")"
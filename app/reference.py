@@ -0,0 +1,216 @@
+"""
+Reference data: legislators, FEC candidates and committees, Schedule B
+codes and the name index built over them.
+
+Each load produces a new, read-only ReferenceData generation which
+replaces the current one with a single assignment, so a reload never
+exposes half-built maps. Requests pin the generation they first see (see
+current_reference) and keep using it even if a reload lands meanwhile.
+
+Workers reload when the source files or the snapshot change (checked at
+most every RELOAD_CHECK_INTERVAL seconds, e.g. after `flask build-snapshot`)
+or when sent RELOAD_SIGNAL.
+"""
+import os
+import signal
+import threading
+import time
+from types import MappingProxyType
+
+import yaml
+from flask import g, has_request_context
+
+from app.fec import find_fec_files, latest, load_fec_cycles
+from app.names import build_name_index
+from app.snapshot import load_snapshot
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+CURRENT_LEGISLATORS_PATH = os.path.join(DATA_DIR, "legislators-current.yaml")
+
+EXECUTIVE_PATH = os.path.join(DATA_DIR, "executive.yaml")
+
+SCHEDULE_B_CODES_PATH = os.path.join(DATA_DIR, "schedule_b_codes.txt")
+
+SNAPSHOT_PATH = os.path.join(DATA_DIR, "id_maps.snapshot")
+
+MAP_NAMES = [
+    "govtrack",
+    "lis",
+    "bioguide",
+    "fec",
+    "committee",
+    "schedule_b_codes",
+    # FEC data per election cycle; fec and committee hold the latest
+    "fec_cycles",
+    "committee_cycles",
+    # Every id above to its display name, see app.names
+    "names",
+]
+
+# Seconds between checks of the source files for changes
+RELOAD_CHECK_INTERVAL = 30
+
+RELOAD_SIGNAL = getattr(signal, "SIGUSR2", None)
+
+
+def memory_data_sources():
+    """Every file the id maps are built from."""
+    return [
+        CURRENT_LEGISLATORS_PATH,
+        EXECUTIVE_PATH,
+        SCHEDULE_B_CODES_PATH,
+    ] + sorted(find_fec_files(DATA_DIR).values())
+
+
+def source_stamp():
+    """Cheap fingerprint of the sources and snapshot, from stat() only."""
+    stamp = []
+    for path in memory_data_sources() + [SNAPSHOT_PATH]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamp.append((path, st.st_mtime, st.st_size))
+    return tuple(stamp)
+
+
+class ReferenceData(object):
+    """One immutable generation of the id maps."""
+    __slots__ = ("maps", "stamp", "loaded_at")
+
+    def __init__(self, data, stamp=()):
+        self.maps = MappingProxyType({
+            name: MappingProxyType(data.get(name, {})) for name in MAP_NAMES
+        })
+        self.stamp = stamp
+        self.loaded_at = time.time()
+
+    def __getitem__(self, name):
+        return self.maps[name]
+
+    @property
+    def names(self):
+        return self.maps["names"]
+
+
+def parse_memory_data():
+    """Build the id maps from the source files in app/data."""
+    govtrack_ids = {}
+    lis_ids = {}
+    bioguide_ids = {}
+    fec_ids = {}
+    schedule_b_codes = {}
+
+    print("Parsing memory data ...")
+    # For now, assuming legislators and executive are mutually exclusive
+    with open(CURRENT_LEGISLATORS_PATH, "r") as f1:
+        with open(EXECUTIVE_PATH, "r") as f2:
+            info = yaml.safe_load(f1) + yaml.safe_load(f2)
+            for c in info:
+                details = {key: c[key] for key in c}
+                if "govtrack" in c["id"]:
+                    govtrack_ids[c["id"]["govtrack"]] = details
+
+                if "bioguide" in c["id"]:
+                    bioguide_ids[c["id"]["bioguide"]] = details
+
+                if "lis" in c["id"]:
+                    lis_ids[c["id"]["lis"]] = details
+
+            for profile in govtrack_ids.values():
+                if "official_full" not in profile["name"]:
+                    name = []
+                    for key in ["first", "middle", "last"]:
+                        name.append(profile["name"].get(key, ""))
+                    profile["name"]["official_full"] = " ".join(tok for tok in name if tok)
+
+            # Map FEC ID to profile
+            for gid in govtrack_ids:
+                for fec_id in govtrack_ids[gid]["id"].get("fec", []):
+                    fec_ids[fec_id] = govtrack_ids[gid]
+
+
+    # Legislator profiles take precedence over the FEC's own candidate data
+    fec_cycles, committee_cycles = load_fec_cycles(DATA_DIR)
+    for fec_id, candidate in latest(fec_cycles).items():
+        fec_ids.setdefault(fec_id, candidate)
+    committee_ids = latest(committee_cycles)
+
+    with open(SCHEDULE_B_CODES_PATH) as f:
+        for line in f:
+            data = line.split(" ", 1)
+            schedule_b_codes[data[0].strip()] = data[1].strip()
+
+    data = {
+        "govtrack": govtrack_ids,
+        "lis": lis_ids,
+        "bioguide": bioguide_ids,
+        "fec": fec_ids,
+        "committee": committee_ids,
+        "schedule_b_codes": schedule_b_codes,
+        "fec_cycles": fec_cycles,
+        "committee_cycles": committee_cycles,
+    }
+    data["names"] = build_name_index(data)
+    return data
+
+
+_current = ReferenceData({})
+_last_check = 0
+_reloading = threading.Lock()
+
+
+def current_reference():
+    """The generation for this request, or the latest outside of one."""
+    if has_request_context():
+        return g.setdefault("reference_data", _current)
+    return _current
+
+
+def load_reference_data(rebuild=False):
+    """Load a new generation from the snapshot and make it current."""
+    global _current
+    data = load_snapshot(SNAPSHOT_PATH, memory_data_sources(), parse_memory_data,
+                         rebuild=rebuild)
+    # Stamped after loading, which may have rewritten the snapshot
+    _current = ReferenceData(data, source_stamp())
+    return _current
+
+
+def reload_reference_data():
+    """Load a new generation in a background thread, once at a time."""
+    if not _reloading.acquire(False):
+        return
+
+    def reload():
+        try:
+            start = time.time()
+            load_reference_data()
+            print(f"Reloaded reference data in {time.time() - start:.2f}s")
+        except Exception as e:
+            print(f"Reloading reference data failed, keeping the old maps: {e}")
+        finally:
+            _reloading.release()
+
+    threading.Thread(target=reload, daemon=True).start()
+
+
+def check_reference_data():
+    """Reload in the background if the sources changed since the last load."""
+    global _last_check
+    now = time.time()
+    if now - _last_check < RELOAD_CHECK_INTERVAL:
+        return
+    _last_check = now
+    if source_stamp() != _current.stamp:
+        reload_reference_data()
+
+
+def install_reload_signal():
+    """Reload on RELOAD_SIGNAL. Must be called from the main thread."""
+    if RELOAD_SIGNAL is None:
+        return
+    signal.signal(RELOAD_SIGNAL, lambda signum, frame: reload_reference_data())
+    # Don't interrupt system calls of the request being served
+    signal.siginterrupt(RELOAD_SIGNAL, False)
@@ -0,0 +1,446 @@
+import base64
+import datetime
+from collections import defaultdict, namedtuple
+
+import orjson
+from flask import current_app
+from sqlalchemy import (
+    and_, bindparam, false, func, intersect, not_, or_, select, true
+)
+
+from app import db
+from app.cache import query_cache
+from app.fts import fts_matches
+from app.models.activity import (
+    INDEXED_ATTRS, Generation, KeywordStat, Result, ResultAttr, Tag,
+    normalize_attr
+)
+from app.query import (
+    Attr, DateRange, Not, Or, Term, TypeFilter, canonical, conjuncts
+)
+from app.util import tokenize
+
+
+# Posting lists at most this long are read into memory and used to probe
+# the remaining keywords, instead of intersecting full lists in SQL
+MATERIALIZE_LIMIT = 5000
+
+# Candidate ids per probe query
+PROBE_CHUNK = 500
+
+
+def tag_index_ready():
+    """True once `flask tag-db` has populated the inverted index."""
+    return db.session.query(Tag.id).first() is not None
+
+
+def attr_index_ready():
+    """
+    True once every result is in result_attrs. Only results older than the
+    oldest one in it can be missing (see publish_attrs).
+    """
+    oldest = db.session.query(func.min(ResultAttr.result_id)).scalar()
+    if oldest is None:
+        return False
+    return db.session.query(Result.id).filter(Result.id < oldest).first() is None
+
+
+def keyword_stats_ready():
+    return db.session.query(KeywordStat.keyword).first() is not None
+
+
+def posting_list(keyword):
+    """Select the ids of the results tagged with a single keyword."""
+    return db.session.query(Tag.result_id)\
+                     .filter(Tag.keyword == keyword)\
+                     .subquery().select()
+
+
+def id_list(ids):
+    """IN clause for a materialized id list, rendered inline."""
+    return Result.id.in_(bindparam("ids", sorted(ids), expanding=True,
+                                   literal_execute=True, unique=True))
+
+
+class Planner(object):
+    """
+    Compiles a parsed query (see app.query) into a filter on Result.
+
+    Positive keywords that must all match are evaluated together, in order
+    of document frequency from the keyword_stats table. When the rarest one
+    has a short posting list, its ids are fetched and each following keyword
+    only probes the index for those candidates, so AND-ing a rare keyword
+    with a very common one costs about as much as the rare one alone.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.use_tags = backend == "tags" and tag_index_ready()
+        self.use_stats = self.use_tags and keyword_stats_ready()
+        self.use_attrs = attr_index_ready()
+        self.n_subqueries = 0
+
+    def frequencies(self, tokens):
+        if not self.use_stats:
+            return {}
+        rows = db.session.query(KeywordStat.keyword, KeywordStat.df)\
+                         .filter(KeywordStat.keyword.in_(tokens))\
+                         .all()
+        df = {token: 0 for token in tokens}
+        df.update(rows)
+        return df
+
+    def probe(self, token, candidates):
+        """The candidates that are also tagged with token."""
+        candidates = sorted(candidates)
+        matched = set()
+        for i in range(0, len(candidates), PROBE_CHUNK):
+            chunk = candidates[i:i + PROBE_CHUNK]
+            matched.update(
+                id for id, in db.session.query(Tag.result_id)
+                                        .filter(Tag.keyword == token)
+                                        .filter(Tag.result_id.in_(chunk))
+            )
+        return matched
+
+    def fts_subquery(self, texts):
+        self.n_subqueries += 1
+        return fts_matches(db, texts, name=f"fts{self.n_subqueries}")
+
+    def compile_terms(self, terms):
+        """Clause requiring every term (keyword or phrase) to match."""
+        if self.backend == "fts":
+            matches = self.fts_subquery([t.text for t in terms])
+            if matches is None:
+                return true()
+            return Result.id.in_(select(matches.c.result_id))
+
+        if not self.use_tags:
+            return and_(*[Result.tags.ilike(f"%{t.text}%") for t in terms])
+
+        tokens = []
+        for t in terms:
+            for token in tokenize(t.text):
+                if token not in tokens:
+                    tokens.append(token)
+        if not tokens:
+            return true()
+
+        df = self.frequencies(tokens)
+        if any(df.get(token) == 0 for token in tokens):
+            return false()
+        tokens.sort(key=lambda token: df.get(token, float("inf")))
+
+        if df and df[tokens[0]] <= MATERIALIZE_LIMIT:
+            candidates = set(id for id, in db.session.execute(posting_list(tokens[0])))
+            for token in tokens[1:]:
+                if not candidates:
+                    break
+                candidates = self.probe(token, candidates)
+            if not candidates:
+                return false()
+            clause = id_list(candidates)
+        elif len(tokens) == 1:
+            clause = Result.id.in_(posting_list(tokens[0]))
+        else:
+            clause = Result.id.in_(intersect(*[posting_list(t) for t in tokens]))
+
+        phrases = [
+            Result.tags.ilike(f"%{t.text}%")
+            for t in terms if len(t.text.split()) > 1
+        ]
+        return and_(clause, *phrases)
+
+    def compile(self, node):
+        if isinstance(node, Term):
+            return self.compile_terms([node])
+        if isinstance(node, Attr):
+            if node.key in INDEXED_ATTRS and self.use_attrs:
+                return Result.id.in_(
+                    select(ResultAttr.result_id)
+                    .where(ResultAttr.key == node.key)
+                    .where(ResultAttr.value == normalize_attr(node.value))
+                )
+            return Result.details.like(f'%"{node.key}": "{node.value}"%')
+        if isinstance(node, TypeFilter):
+            return Result.type == node.type
+        if isinstance(node, DateRange):
+            clauses = []
+            if node.start is not None:
+                clauses.append(Result.date >= node.start)
+            if node.end is not None:
+                clauses.append(Result.date < node.end + datetime.timedelta(days=1))
+            return and_(*clauses)
+        if isinstance(node, Not):
+            return not_(self.compile(node.child))
+        if isinstance(node, Or):
+            return or_(*[self.compile(child) for child in node.children])
+        return self.compile_conjunction(node.children)
+
+    def compile_conjunction(self, nodes):
+        terms = [n for n in nodes if isinstance(n, Term)]
+        others = [n for n in nodes if not isinstance(n, Term)]
+        clauses = [self.compile_terms(terms)] if terms else []
+        clauses.extend(self.compile(n) for n in others)
+        return and_(*clauses)
+
+
+def search_tags(q, node):
+    if node is not None:
+        q = q.filter(Planner("tags").compile(node))
+    return q.order_by(Result.date.desc(), Result.id.desc()), False
+
+
+def search_fts(q, node):
+    """
+    Keywords that must all match are looked up in one full-text query that
+    also ranks the results; everything else becomes a plain filter.
+    """
+    planner = Planner("fts")
+    nodes = conjuncts(node)
+    terms = [n for n in nodes if isinstance(n, Term)]
+    others = [n for n in nodes if not isinstance(n, Term)]
+    if others:
+        q = q.filter(planner.compile_conjunction(others))
+
+    matches = planner.fts_subquery([t.text for t in terms]) if terms else None
+    if matches is None:
+        return q.order_by(Result.date.desc(), Result.id.desc()), False
+    return q.join(matches, matches.c.result_id == Result.id)\
+            .order_by(matches.c.rank, Result.date.desc(), Result.id.desc()), True
+
+
+SEARCH_BACKENDS = {
+    "tags": search_tags,
+    "fts": search_fts,
+}
+
+
+def search(q, node):
+    """
+    Filter and order a Result query by a parsed query, using the configured
+    search backend.
+
+    Returns the query and whether it is ordered by relevance rank (rather
+    than by (date, id), newest first).
+    """
+    backend = current_app.config.get("SEARCH_BACKEND", "tags")
+    return SEARCH_BACKENDS[backend](q, node)
+
+
+def count_by_type(q):
+    """Number of matches per result type (plus "all") in a single query."""
+    rows = q.order_by(None)\
+            .with_entities(Result.type, func.count(Result.id))\
+            .group_by(Result.type)\
+            .all()
+    counts = defaultdict(int, rows)
+    counts["all"] = sum(n for _, n in rows)
+    return counts
+
+
+# Columns fetched for displayed results; rows map onto LazyResult
+RESULT_COLUMNS = (
+    Result.id,
+    Result.date,
+    Result.type,
+    Result.source,
+    Result.tags,
+    Result.last_updated,
+    Result.details,
+)
+
+
+class LazyResult(object):
+    """
+    A result row for display.
+
+    Behaves like the dict of details plus the row's own fields that the
+    templates used to get, but the details JSON is only decoded when one of
+    its keys is first read.
+    """
+    __slots__ = ("id", "date", "activity_type", "source", "tags",
+                 "last_updated", "_raw", "_details")
+
+    FIELDS = ("id", "date", "activity_type", "source", "tags", "last_updated")
+
+    def __init__(self, id, date, type, source, tags, last_updated, details):
+        self.id = id
+        self.date = date
+        self.activity_type = type
+        self.source = source
+        self.tags = tags
+        self.last_updated = last_updated
+        self._raw = details
+        self._details = None
+
+    @property
+    def details(self):
+        if self._details is None:
+            self._details = orjson.loads(self._raw) if self._raw else {}
+        return self._details
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self.details[key]
+
+    def __getattr__(self, key):
+        # Only called for names that are not slots, i.e. details keys
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self.details[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS or key in self.details
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+# Hard cap on the number of results returned per page
+MAX_PAGE_SIZE = 500
+
+CURSOR_DATE_FMT = "%Y-%m-%dT%H:%M:%S.%f"
+
+Page = namedtuple("Page", ["rows", "next_cursor", "prev_cursor"])
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(orjson.dumps(position)).decode()
+
+
+def decode_cursor(token):
+    """Decode a page cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        position = orjson.loads(base64.urlsafe_b64decode(token.encode()))
+        if "offset" in position:
+            position["offset"] = max(0, int(position["offset"]))
+        else:
+            position["id"] = int(position["id"])
+            position["date"] = datetime.datetime.strptime(
+                position["date"], CURSOR_DATE_FMT)
+        return position
+    except Exception:
+        return None
+
+
+def keyset_cursor(row, direction):
+    return encode_cursor({
+        "date": row.date.strftime(CURSOR_DATE_FMT),
+        "id": row.id,
+        "dir": direction,
+    })
+
+
+def get_page(q, data_type, n_per_page, cursor=None, ranked=False):
+    """
+    Fetch one page of an ordered search query for a single tab.
+
+    Date ordered queries page by keyset on (date, id): the cursor holds the
+    position of the first/last row of the neighbouring page, so any page
+    costs the same as the first one. Relevance ordered queries have no such
+    key and the cursor holds an offset instead.
+    """
+    n_per_page = min(n_per_page, MAX_PAGE_SIZE)
+    if data_type != "all":
+        q = q.filter(Result.type == data_type)
+    q = q.with_entities(*RESULT_COLUMNS)
+
+    position = decode_cursor(cursor)
+
+    if ranked:
+        offset = position.get("offset", 0) if position else 0
+        rows = q.offset(offset).limit(n_per_page + 1).all()
+        next_cursor = None
+        if len(rows) > n_per_page:
+            rows = rows[:n_per_page]
+            next_cursor = encode_cursor({"offset": offset + n_per_page})
+        prev_cursor = None
+        if offset > 0:
+            prev_cursor = encode_cursor({"offset": max(0, offset - n_per_page)})
+        return Page([LazyResult(*row) for row in rows], next_cursor, prev_cursor)
+
+    if position is None or "date" not in position:
+        rows = q.limit(n_per_page + 1).all()
+        has_next, has_prev = len(rows) > n_per_page, False
+        rows = rows[:n_per_page]
+    elif position.get("dir") == "prev":
+        d, id = position["date"], position["id"]
+        rows = q.order_by(None)\
+                .order_by(Result.date.asc(), Result.id.asc())\
+                .filter(or_(Result.date > d, and_(Result.date == d, Result.id > id)))\
+                .limit(n_per_page + 1)\
+                .all()
+        has_next, has_prev = True, len(rows) > n_per_page
+        rows = rows[:n_per_page][::-1]
+    else:
+        d, id = position["date"], position["id"]
+        rows = q.filter(or_(Result.date < d, and_(Result.date == d, Result.id < id)))\
+                .limit(n_per_page + 1)\
+                .all()
+        has_next, has_prev = len(rows) > n_per_page, True
+        rows = rows[:n_per_page]
+
+    next_cursor = keyset_cursor(rows[-1], "next") if rows and has_next else None
+    prev_cursor = keyset_cursor(rows[0], "prev") if rows and has_prev else None
+    return Page([LazyResult(*row) for row in rows], next_cursor, prev_cursor)
+
+
+def current_generation():
+    row = db.session.query(Generation.generation).filter(Generation.id == 1).first()
+    return row[0] if row else 0
+
+
+def cache_key(node, data_type, n_per_page, cursor):
+    """Key a search on its parsed (not raw) form and the data generation."""
+    return orjson.dumps({
+        "generation": current_generation(),
+        "backend": current_app.config.get("SEARCH_BACKEND", "tags"),
+        "query": canonical(node),
+        "type": data_type,
+        "npp": min(n_per_page, MAX_PAGE_SIZE),
+        "cursor": cursor or "",
+    }).decode()
+
+
+def load_results(ids):
+    """Fetch results by id, in the order of ids."""
+    if not ids:
+        return []
+    rows = db.session.query(*RESULT_COLUMNS).filter(Result.id.in_(ids))
+    by_id = {row.id: LazyResult(*row) for row in rows}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+def run_search(node, data_type, n_per_page, cursor=None):
+    """
+    Search and fetch one page of results, going through the query cache.
+
+    Returns the page and the per-type match counts.
+    """
+    key = cache_key(node, data_type, n_per_page, cursor)
+    cached = query_cache.get(key)
+    if cached is not None:
+        page = Page(load_results(cached["ids"]), cached["next"], cached["prev"])
+        return page, defaultdict(int, cached["counts"])
+
+    q, ranked = search(Result.query, node)
+    counts = count_by_type(q)
+    page = get_page(q, data_type, n_per_page, cursor=cursor, ranked=ranked)
+
+    query_cache.set(key, {
+        "ids": [r.id for r in page.rows],
+        "next": page.next_cursor,
+        "prev": page.prev_cursor,
+        "counts": dict(counts),
+    })
+    return page, counts
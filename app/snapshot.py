@@ -0,0 +1,95 @@
+"""
+Binary snapshot of the in-memory reference data (legislators, FEC
+candidates and committees, Schedule B codes).
+
+Parsing the YAML and FEC text files takes seconds, so the parsed maps are
+pickled into one file together with the hash of every source file they
+were built from. Loading the snapshot takes milliseconds; when any source
+hash (or the snapshot format) changes the maps are parsed again and the
+snapshot rewritten.
+
+Layout: MAGIC, format version (uint32), header length (uint32), JSON
+header {"version", "sources"}, pickled payload.
+"""
+import hashlib
+import os
+import pickle
+import struct
+import time
+
+import orjson
+
+MAGIC = b"GOVIDX\0"
+
+# Bump whenever the layout of the pickled data changes
+SNAPSHOT_VERSION = 3
+
+HEADER = struct.Struct("<II")
+
+HASH_BUF_SIZE = 1 << 20
+
+
+def hash_source(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(HASH_BUF_SIZE)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def source_hashes(paths):
+    return {os.path.basename(path): hash_source(path) for path in paths}
+
+
+def read_snapshot(path, hashes):
+    """The snapshot's data, or None if it is missing or stale."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            version, header_len = HEADER.unpack(f.read(HEADER.size))
+            if version != SNAPSHOT_VERSION:
+                return None
+            header = orjson.loads(f.read(header_len))
+            if header.get("sources") != hashes:
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, struct.error, orjson.JSONDecodeError,
+            pickle.UnpicklingError):
+        return None
+
+
+def write_snapshot(path, hashes, data):
+    header = orjson.dumps({"version": SNAPSHOT_VERSION, "sources": hashes})
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Readers in other workers only ever see a complete file
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, sources, build, rebuild=False):
+    """
+    Load the snapshot at path, rebuilding it with build() first if it is
+    missing, stale or rebuild is set.
+    """
+    start = time.time()
+    hashes = source_hashes(sources)
+    data = None if rebuild else read_snapshot(path, hashes)
+    if data is not None:
+        print(f"Loaded snapshot {path} in {time.time() - start:.3f}s")
+        return data
+
+    data = build()
+    try:
+        write_snapshot(path, hashes, data)
+        print(f"Built snapshot {path} in {time.time() - start:.3f}s")
+    except OSError as e:
+        print(f"Unable to write snapshot {path}: {e}")
+    return data
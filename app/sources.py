@@ -0,0 +1,103 @@
+"""
+Publish sources: plain files, members of .zip archives and .gz files.
+
+Bulk data is read straight from the archives it is downloaded as instead of
+being extracted first. A zip member is named by the archive's path and the
+member's name joined with "!" (ld2.zip!2019/300001.xml); that name is what
+LocalFile, FileManifest and publish tasks record. A .gz file is a single
+source named by its own path. Only archives given as the source to publish
+are expanded, never ones found inside a source directory.
+
+Zip members are identified by the CRC32 and size the archive's central
+directory already holds, so finding what changed never decompresses them.
+"""
+import glob
+import gzip
+import os
+import zipfile
+
+MEMBER_SEP = "!"
+ZIP_EXT = ".zip"
+GZIP_EXT = ".gz"
+
+
+def split_source(path):
+    """(archive, member) for a zip member, (path, None) for anything else."""
+    i = path.find(ZIP_EXT + MEMBER_SEP)
+    if i < 0:
+        return path, None
+    return path[:i + len(ZIP_EXT)], path[i + len(ZIP_EXT) + len(MEMBER_SEP):]
+
+
+def source_name(path):
+    """File name of a source, without its archive path or .gz extension."""
+    _, member = split_source(path)
+    name = os.path.basename(member if member is not None else path)
+    return name[:-len(GZIP_EXT)] if name.endswith(GZIP_EXT) else name
+
+
+def compressed(path):
+    """Whether path is read through a decompressor (no random access)."""
+    return split_source(path)[1] is not None or path.endswith(GZIP_EXT)
+
+
+def zip_members(archive):
+    with zipfile.ZipFile(archive) as z:
+        return [
+            archive + MEMBER_SEP + info.filename
+            for info in z.infolist()
+            if not info.filename.endswith("/")
+        ]
+
+
+def list_sources(source):
+    """
+    Every source in source: a directory (searched recursively), a .zip
+    archive or a single file.
+
+    Only a .zip given as the source itself is expanded: a directory often
+    holds extracted files next to the archive they came from, so archives
+    found in it are listed as they are, and a .gz file is skipped when its
+    extracted copy sits next to it.
+    """
+    if os.path.isfile(source):
+        return zip_members(source) if source.endswith(ZIP_EXT) else [source]
+    paths = glob.glob(os.path.join(source, "**"), recursive=True)
+    extracted = set(paths)
+    return [
+        path for path in paths
+        if not (path.endswith(GZIP_EXT) and path[:-len(GZIP_EXT)] in extracted)
+    ]
+
+
+def member_fingerprints(paths):
+    """
+    {path: "crc32:<crc>:<size>"} for the zip members in paths, reading each
+    archive's central directory once.
+    """
+    by_archive = {}
+    for path in paths:
+        archive, member = split_source(path)
+        if member is not None:
+            by_archive.setdefault(archive, []).append(member)
+
+    fingerprints = {}
+    for archive, members in by_archive.items():
+        with zipfile.ZipFile(archive) as z:
+            for member in members:
+                info = z.getinfo(member)
+                fingerprints[archive + MEMBER_SEP + member] = \
+                    f"crc32:{info.CRC:08x}:{info.file_size}"
+    return fingerprints
+
+
+def open_source(path):
+    """A binary file object reading the (decompressed) contents of path."""
+    archive, member = split_source(path)
+    if member is not None:
+        # The member keeps the archive's file open until it is closed itself
+        with zipfile.ZipFile(archive) as z:
+            return z.open(member)
+    if path.endswith(GZIP_EXT):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
@@ -0,0 +1,140 @@
+"""
+Keyword autocomplete.
+
+The vocabulary is every keyword in the tag index that appears in more than
+one result and contains a letter (ids, amounts and dates are left out),
+with its document frequency (from keyword_stats). It is held in memory as
+a sorted list so that a prefix maps to a contiguous range found by
+bisection. The best completions of every short prefix are precomputed,
+since their ranges are the largest.
+
+Each worker builds it on startup and rebuilds it in the background once
+the publish generation changes, i.e. after a publish or `flask tag-db`.
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from app import db
+from app.models.activity import KeywordStat, Tag
+from app.search import current_generation
+from app.util import normalize_keyword
+
+MAX_SUGGESTIONS = 10
+
+# Keywords in fewer results than this are never suggested
+MIN_DF = 2
+
+# Prefixes up to this length have their completions precomputed
+PRECOMPUTED_PREFIX_LEN = 3
+
+# Seconds between checks of the publish generation
+REFRESH_INTERVAL = 30
+
+
+class Vocabulary(object):
+    def __init__(self, rows=(), generation=None):
+        rows = sorted(rows)
+        self.keywords = [keyword for keyword, _ in rows]
+        self.counts = [df for _, df in rows]
+        self.generation = generation
+
+        top = defaultdict(list)
+        for keyword, df in rows:
+            for n in range(1, min(len(keyword), PRECOMPUTED_PREFIX_LEN) + 1):
+                heap = top[keyword[:n]]
+                if len(heap) < MAX_SUGGESTIONS:
+                    heapq.heappush(heap, (df, keyword))
+                elif df > heap[0][0]:
+                    heapq.heapreplace(heap, (df, keyword))
+        self.top = {
+            prefix: sorted(heap, key=lambda entry: (-entry[0], entry[1]))
+            for prefix, heap in top.items()
+        }
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """(keyword, document frequency) pairs starting with prefix, most common first."""
+        limit = max(0, min(limit, MAX_SUGGESTIONS))
+        if not prefix or not limit:
+            return []
+        if len(prefix) <= PRECOMPUTED_PREFIX_LEN:
+            return [(kw, df) for df, kw in self.top.get(prefix, [])[:limit]]
+
+        lo = bisect.bisect_left(self.keywords, prefix)
+        hi = bisect.bisect_left(self.keywords, prefix + "\uffff", lo)
+        best = heapq.nsmallest(
+            limit, range(lo, hi),
+            key=lambda i: (-self.counts[i], self.keywords[i])
+        )
+        return [(self.keywords[i], self.counts[i]) for i in best]
+
+
+def suggestible(keyword):
+    return any(c.isalpha() for c in keyword)
+
+
+def build_vocabulary():
+    generation = current_generation()
+    rows = db.session.query(KeywordStat.keyword, KeywordStat.df)\
+                     .filter(KeywordStat.df >= MIN_DF)\
+                     .all()
+    if not rows and db.session.query(KeywordStat.keyword).first() is None:
+        # tag-db predates keyword_stats
+        df = func.count(Tag.result_id.distinct())
+        rows = db.session.query(Tag.keyword, df)\
+                         .group_by(Tag.keyword)\
+                         .having(df >= MIN_DF)\
+                         .all()
+    return Vocabulary(
+        [(keyword, df) for keyword, df in rows if suggestible(keyword)],
+        generation
+    )
+
+
+vocabulary = Vocabulary()
+_last_check = 0
+_refreshing = threading.Lock()
+
+
+def load_vocabulary():
+    global vocabulary
+    start = time.time()
+    vocabulary = build_vocabulary()
+    print(f"Loaded {len(vocabulary)} keywords for suggestions "
+          f"in {time.time() - start:.2f}s")
+
+
+def refresh_vocabulary(app):
+    """Rebuild the vocabulary in the background if the data has changed."""
+    global _last_check
+    now = time.time()
+    if now - _last_check < REFRESH_INTERVAL:
+        return
+    _last_check = now
+    if current_generation() == vocabulary.generation:
+        return
+    if not _refreshing.acquire(False):
+        return
+
+    def rebuild():
+        try:
+            with app.app_context():
+                load_vocabulary()
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=rebuild, daemon=True).start()
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    words = prefix.split()
+    if not words:
+        return []
+    return vocabulary.suggest(normalize_keyword(words[-1]), limit)
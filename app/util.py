@@ -0,0 +1,36 @@
+import string
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1 << 16)
+def normalize_keyword(kw):
+    """Lowercase a keyword and strip one punctuation char from each end."""
+    kw = kw.lower()
+    if kw and kw[0] in string.punctuation:
+        kw = kw[1::]
+    if kw and kw[-1] in string.punctuation:
+        kw = kw[:-1:]
+    return kw
+
+
+def tokenize(text):
+    """
+    Split free text into the normalized keywords stored in the tag index,
+    breaking on commas as well as whitespace like tokenize_tags.
+    """
+    keywords = []
+    for kw in text.replace(",", " ").split():
+        kw = normalize_keyword(kw)
+        if kw and kw not in keywords:
+            keywords.append(kw)
+    return keywords
+
+
+def tokenize_tags(tags):
+    """Keywords for a Result.tags string (comma separated values)."""
+    keywords = set(
+        normalize_keyword(kw)
+        for kw in tags.replace(",", " ").split()
+    )
+    keywords.discard("")
+    return keywords
@@ -12,6 +12,31 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = config('SQLALCHEMY_DATABASE_URI', default='sqlite:///test-3.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Search backend for /index: "tags" (inverted tag index) or "fts"
+    # (SQLite FTS5 / PostgreSQL tsvector shadow table)
+    SEARCH_BACKEND = config('SEARCH_BACKEND', default='tags')
+
+    # Search result cache (entries per worker, seconds to live). Set
+    # SEARCH_CACHE_PATH to a local sqlite file to share it between workers.
+    SEARCH_CACHE_SIZE = config('SEARCH_CACHE_SIZE', default=1024, cast=int)
+    SEARCH_CACHE_TTL = config('SEARCH_CACHE_TTL', default=300, cast=int)
+    SEARCH_CACHE_PATH = config('SEARCH_CACHE_PATH', default='')
+
+    # Load reference data and the suggestion vocabulary in create_app instead
+    # of on the first request. gunicorn-cfg.py turns this on so the master
+    # loads them once and workers share them copy-on-write.
+    PRELOAD_REFERENCE_DATA = config('PRELOAD_REFERENCE_DATA', default=False, cast=bool)
+
+    # Processes parsing source files during a publish (0: one per core)
+    PUBLISH_WORKERS = config('PUBLISH_WORKERS', default=0, cast=int)
+
+    # Manifest entries `flask publish` runs at once (0: all of them). They
+    # share the PUBLISH_WORKERS processes and take turns writing.
+    PUBLISH_CONCURRENCY = config('PUBLISH_CONCURRENCY', default=0, cast=int)
+
+    # Rows written per executemany / COPY while publishing
+    BULK_BATCH_SIZE = config('BULK_BATCH_SIZE', default=5000, cast=int)
+
 class ProductionConfig(Config):
     DEBUG = False
 
@@ -2,10 +2,36 @@
 """
 Copyright (c) 2019 - present AppSeed.us
 """
+import gc
+import multiprocessing
+import os
+
+# Load the app (and with it the reference data, see PRELOAD_REFERENCE_DATA)
+# once in the master. Workers share the maps copy-on-write, so they are
+# cheap enough to run one per core.
+os.environ.setdefault('PRELOAD_REFERENCE_DATA', 'True')
+preload_app = True
 
 bind = '0.0.0.0:5005'
-workers = 1
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
 accesslog = '-'
 loglevel = 'debug'
 capture_output = True
 enable_stdio_inheritance = True
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any worker is
+    # forked. Moving everything allocated so far into the permanent
+    # generation keeps collections in the workers from writing to (and so
+    # copying) the pages holding the reference data. Python 3.7+ only.
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+        server.log.info('Froze %d objects before forking', gc.get_freeze_count())
+
+
+def post_worker_init(worker):
+    # `kill -USR2 <worker pid>` reloads the reference data in that worker
+    from app.reference import install_reload_signal
+    install_reload_signal()